@@ -0,0 +1,278 @@
+"""Stand-in ComfyUI server and image host for offline benchmarks.
+
+Implements the parts of the ComfyUI API the handler uses (``/upload/image``,
+``/prompt``, ``/ws``, ``/history``, ``/view``, ``/queue``, ``/interrupt``,
+``/system_stats``) with a configurable execution delay, and serves
+synthetic source images under ``/images/<W>x<H>.<ext>``. Prompts run one
+at a time, like on a single GPU.
+
+    python -m bench.fake_comfy --port 8190 --delay 0.5 --output-dir /tmp/bench_output
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import uuid
+import zlib
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+IMAGE_FORMATS = {"jpg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png"), "webp": ("WEBP", "image/webp")}
+
+
+def synthetic_image(width: int, height: int, fmt: str) -> bytes:
+    """Encode a noisy RGB image, so codecs do roughly the work they do on photos."""
+    channels = [Image.effect_noise((width, height), 40 + 10 * i) for i in range(3)]
+    image = Image.merge("RGB", channels)
+    buf = BytesIO()
+    image.save(buf, format=IMAGE_FORMATS[fmt][0], quality=90)
+    return buf.getvalue()
+
+
+def with_variant(data: bytes, fmt: str, variant: int) -> bytes:
+    """Make the bytes (and so the content hash) unique per variant without re-encoding.
+
+    JPEGs get a comment segment after the SOI marker and PNGs a ``tEXt``
+    chunk after ``IHDR``; WEBP variants are identical.
+    """
+    if variant == 0:
+        return data
+    text = f"variant {variant}".encode()
+    if fmt == "jpg":
+        return data[:2] + b"\xff\xfe" + struct.pack(">H", len(text) + 2) + text + data[2:]
+    if fmt == "png":
+        chunk = b"tEXt" + b"bench\x00" + text
+        encoded = struct.pack(">I", len(chunk) - 4) + chunk + struct.pack(">I", zlib.crc32(chunk))
+        ihdr_end = 8 + 8 + 13 + 4
+        return data[:ihdr_end] + encoded + data[ihdr_end:]
+    return data
+
+
+class FakeComfy:
+    """In-memory ComfyUI that executes prompts by sleeping."""
+
+    def __init__(self, delay: float, output_dir: str | None, output_size: int):
+        self.delay = delay
+        self.output_dir = output_dir
+        self.inputs: dict[str, bytes] = {}
+        self.outputs: dict[str, bytes] = {}
+        self.history: dict[str, dict] = {}
+        self.sockets: dict[str, web.WebSocketResponse] = {}
+        self.pending: list[tuple[str, dict, str]] = []
+        self.running: str | None = None
+        self.interrupted = asyncio.Event()
+        # Generated once per size; concurrent first requests share the generation
+        self.images: dict[tuple, asyncio.Future] = {}
+        self.saved = 0
+        self._wakeup = asyncio.Event()
+        self._output_png = synthetic_image(output_size, output_size, "png")
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=256 * 1024 * 1024)
+        app.router.add_post("/upload/image", self.upload_image)
+        app.router.add_post("/prompt", self.queue_prompt)
+        app.router.add_get("/history/{prompt_id}", self.get_history)
+        app.router.add_get("/view", self.view)
+        app.router.add_get("/queue", self.get_queue)
+        app.router.add_post("/queue", self.delete_from_queue)
+        app.router.add_post("/interrupt", self.interrupt)
+        app.router.add_get("/system_stats", self.system_stats)
+        app.router.add_get("/ws", self.websocket)
+        app.router.add_get("/images/{name}", self.source_image)
+        app.on_startup.append(self._start_worker)
+        return app
+
+    async def _start_worker(self, app):
+        app["worker"] = asyncio.create_task(self._worker())
+
+    # ComfyUI API
+
+    async def upload_image(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        field = form["image"]
+        name = field.filename
+        if name in self.inputs and form.get("overwrite") != "true":
+            stem, ext = os.path.splitext(name)
+            name = f"{stem}_{uuid.uuid4().hex[:6]}{ext}"
+        self.inputs[name] = field.file.read()
+        return web.json_response({"name": name, "subfolder": "", "type": "input"})
+
+    async def queue_prompt(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        prompt = body["prompt"]
+        node_errors = {
+            node_id: {"errors": [{"message": f"Invalid image file: {node['inputs']['image']}"}]}
+            for node_id, node in prompt.items()
+            if node.get("class_type") == "LoadImage" and node["inputs"]["image"] not in self.inputs
+        }
+        if node_errors:
+            return web.json_response({"error": {"type": "prompt_outputs_failed_validation"}, "node_errors": node_errors}, status=400)
+
+        prompt_id = body.get("prompt_id") or str(uuid.uuid4())
+        self.pending.append((prompt_id, prompt, body.get("client_id")))
+        self._wakeup.set()
+        await self._broadcast_status()
+        return web.json_response({"prompt_id": prompt_id, "number": len(self.history), "node_errors": {}})
+
+    async def get_history(self, request: web.Request) -> web.Response:
+        prompt_id = request.match_info["prompt_id"]
+        entry = self.history.get(prompt_id)
+        return web.json_response({prompt_id: entry} if entry else {})
+
+    async def view(self, request: web.Request) -> web.Response:
+        data = self.outputs.get(request.query.get("filename", ""))
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data, content_type="image/png")
+
+    async def get_queue(self, request: web.Request) -> web.Response:
+        running = [[0, self.running, {}, {}, []]] if self.running else []
+        pending = [[i + 1, prompt_id, {}, {}, []] for i, (prompt_id, _, _) in enumerate(self.pending)]
+        return web.json_response({"queue_running": running, "queue_pending": pending})
+
+    async def delete_from_queue(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        doomed = set(body.get("delete", []))
+        if body.get("clear"):
+            doomed = {prompt_id for prompt_id, _, _ in self.pending}
+        self.pending = [entry for entry in self.pending if entry[0] not in doomed]
+        await self._broadcast_status()
+        return web.Response()
+
+    async def interrupt(self, request: web.Request) -> web.Response:
+        if self.running is not None:
+            self.interrupted.set()
+        return web.Response()
+
+    async def system_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"system": {"os": "fake", "comfyui_version": "bench"}, "devices": []})
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId") or uuid.uuid4().hex
+        self.sockets[client_id] = ws
+        await ws.send_str(json.dumps(self._status(client_id)))
+        async for _ in ws:
+            pass
+        self.sockets.pop(client_id, None)
+        return ws
+
+    # Source images
+
+    async def source_image(self, request: web.Request) -> web.Response:
+        """``/images/<W>x<H>.<ext>?v=<n>``; different ``v`` give different bytes."""
+        stem, _, ext = request.match_info["name"].partition(".")
+        if ext not in IMAGE_FORMATS:
+            raise web.HTTPNotFound()
+        try:
+            width, height = (int(v) for v in stem.split("x"))
+        except ValueError:
+            raise web.HTTPNotFound()
+        variant = int(request.query.get("v", 0))
+        key = (width, height, ext)
+        etag = f'"{width}x{height}-{variant}.{ext}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        if key not in self.images:
+            self.images[key] = asyncio.ensure_future(asyncio.to_thread(synthetic_image, width, height, ext))
+        return web.Response(
+            body=with_variant(await self.images[key], ext, variant),
+            content_type=IMAGE_FORMATS[ext][1],
+            headers={"ETag": etag, "Cache-Control": "max-age=3600"},
+        )
+
+    # Execution
+
+    def _status(self, client_id: str | None = None) -> dict:
+        remaining = len(self.pending) + (1 if self.running else 0)
+        data = {"status": {"exec_info": {"queue_remaining": remaining}}}
+        if client_id:
+            data["sid"] = client_id
+        return {"type": "status", "data": data}
+
+    async def _send(self, client_id: str | None, message: dict):
+        ws = self.sockets.get(client_id)
+        if ws is not None and not ws.closed:
+            try:
+                await ws.send_str(json.dumps(message))
+            except ConnectionError:
+                pass
+
+    async def _broadcast_status(self):
+        for client_id in list(self.sockets):
+            await self._send(client_id, self._status())
+
+    async def _worker(self):
+        while True:
+            if not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            prompt_id, prompt, client_id = self.pending.pop(0)
+            self.running = prompt_id
+            try:
+                await self._execute(prompt_id, prompt, client_id)
+            finally:
+                self.running = None
+                self.interrupted.clear()
+                await self._broadcast_status()
+
+    async def _execute(self, prompt_id: str, prompt: dict, client_id: str | None):
+        await self._send(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+        await self._send(client_id, {"type": "execution_cached", "data": {"nodes": [], "prompt_id": prompt_id}})
+
+        # The sampler takes the whole delay; every other node is instant
+        outputs = {}
+        for node_id, node in prompt.items():
+            await self._send(client_id, {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+            if node.get("class_type") == "KSampler":
+                # Sampling stops at the next step once interrupted
+                try:
+                    await asyncio.wait_for(self.interrupted.wait(), self.delay)
+                except asyncio.TimeoutError:
+                    pass
+            if self.interrupted.is_set():
+                await self._send(client_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id}})
+                self.history[prompt_id] = {"outputs": {}, "status": {"status_str": "error", "completed": False}}
+                return
+            if node.get("class_type") == "SaveImage":
+                self.saved += 1
+                filename = f"ComfyUI_{self.saved:05}_.png"
+                self.outputs[filename] = self._output_png
+                if self.output_dir:
+                    with open(os.path.join(self.output_dir, filename), "wb") as f:
+                        f.write(self._output_png)
+                image = {"filename": filename, "subfolder": "", "type": "output"}
+                outputs[node_id] = {"images": [image]}
+                await self._send(client_id, {
+                    "type": "executed",
+                    "data": {"node": node_id, "prompt_id": prompt_id, "output": {"images": [image]}},
+                })
+
+        self.history[prompt_id] = {"outputs": outputs, "status": {"status_str": "success", "completed": True}}
+        await self._send(client_id, {"type": "execution_success", "data": {"prompt_id": prompt_id}})
+        await self._send(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8190)
+    parser.add_argument("--delay", type=float, default=0.5, help="seconds each prompt spends in the sampler")
+    parser.add_argument("--output-dir", default=None, help="also write outputs here, like ComfyUI's output folder")
+    parser.add_argument("--output-size", type=int, default=1024, help="side of the square output image")
+    args = parser.parse_args()
+
+    fake = FakeComfy(args.delay, args.output_dir, args.output_size)
+    web.run_app(fake.app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""Offline load test of the request path against the stand-in ComfyUI.
+
+Starts ``bench.fake_comfy`` in subprocesses (one per ``--backends``), drives ``LightTransfer.handler``
+in this process at a fixed concurrency and reports throughput, latency
+percentiles per stage (from the ``Server-Timing`` header) and peak RSS.
+Inference is simulated by a fixed delay, so what is measured is the CPU
+and I/O overhead around it; results carry the git commit and settings so
+runs can be compared with ``--baseline``.
+
+    python -m bench.run --requests 100 --concurrency 8 --main-size 2048x1536 --json out.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import HTTPException, Request, Response
+
+import handler
+import image_io
+from fal.toolkit import Image
+
+PERCENTILES = (50, 95, 99)
+
+
+def connected_request() -> Request:
+    """A request whose client stays connected until the handler returns."""
+    async def receive():
+        await asyncio.Event().wait()
+
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": []}, receive)
+
+
+def parse_size(text: str) -> tuple[int, int]:
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    if len(values) == 1:
+        return {f"p{p}": round(values[0] * 1000, 2) for p in PERCENTILES}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {f"p{p}": round(cuts[p - 1] * 1000, 2) for p in PERCENTILES}
+
+
+def parse_server_timing(header: str) -> dict:
+    stages = {}
+    for entry in filter(None, (part.strip() for part in header.split(","))):
+        name, _, duration = entry.partition(";dur=")
+        stages[name] = float(duration) / 1000
+    return stages
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def publish_locally(data, format: str, size=None, **kwargs) -> Image:
+    """Replacement for ``Image.from_bytes`` that skips the CDN upload."""
+    return Image(
+        url=f"https://bench.invalid/{len(data)}.{format}",
+        content_type=f"image/{format}",
+        file_name=f"output.{format}",
+        file_size=len(data),
+        width=size.width if size else None,
+        height=size.height if size else None,
+    )
+
+
+async def wait_for_server(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                (await client.get(url)).raise_for_status()
+                return
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Fake ComfyUI did not start at {url}")
+                await asyncio.sleep(0.1)
+
+
+async def run_requests(app, args, base_url: str) -> dict:
+    main_size = "{}x{}".format(*args.main_size)
+    reference_size = "{}x{}".format(*args.reference_size)
+    reference_url = f"{base_url}/images/{reference_size}.{args.format}"
+
+    def request(index: int) -> handler.LightTransferInput:
+        # Unique main images defeat the input cache, as with real traffic
+        variant = index if args.unique else 0
+        return handler.LightTransferInput(
+            main_image_url=f"{base_url}/images/{main_size}.{args.format}?v={variant}",
+            reference_image_url=reference_url,
+            quality=args.quality,
+            full_resolution=args.full_resolution,
+        )
+
+    latencies, stages, failures, rejected = [], {}, [], []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(index: int, record: bool):
+        async with slots:
+            response = Response()
+            start = time.perf_counter()
+            try:
+                await app.handler(request(index), connected_request(), response)
+            except HTTPException as e:
+                if record:
+                    # 503s are admission control doing its job, not errors
+                    (rejected if e.status_code == 503 else failures).append(str(e.detail))
+                return
+            elapsed = time.perf_counter() - start
+            if record:
+                latencies.append(elapsed)
+                for name, seconds in parse_server_timing(response.headers.get("server-timing", "")).items():
+                    stages.setdefault(name, []).append(seconds)
+
+    # Warm-up requests fill connection pools and caches and are not measured
+    await asyncio.gather(*(one(-1 - i, False) for i in range(args.warmup)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i, True) for i in range(args.requests)))
+    wall = time.perf_counter() - started
+
+    return {
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0,
+        "ok": len(latencies),
+        "failed": len(failures),
+        "rejected": len(rejected),
+        "errors": sorted(set(failures))[:5],
+        "latency_ms": percentiles(latencies),
+        # Per-node timings are ComfyUI's business; everything else is handler overhead
+        "stages_ms": {name: percentiles(values) for name, values in sorted(stages.items()) if not name.startswith("node_")},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def print_report(result: dict, baseline: dict | None):
+    print(f"commit {result['commit']}  {result['settings']}")
+    print(
+        f"{result['ok']} ok, {result['failed']} failed, {result.get('rejected', 0)} rejected in {result['wall_s']} s: "
+        f"{result['throughput_rps']} req/s, peak RSS {result['peak_rss_mb']} MB"
+    )
+    for error in result["errors"]:
+        print(f"  error: {error}")
+
+    rows = [("request", result["latency_ms"])] + list(result["stages_ms"].items())
+    old_rows = dict([("request", baseline["latency_ms"])] + list(baseline["stages_ms"].items())) if baseline else {}
+    print(f"{'stage':<24}" + "".join(f"{f'p{p} ms':>12}" for p in PERCENTILES))
+    for name, values in rows:
+        line = f"{name:<24}" + "".join(f"{values.get(f'p{p}', 0):>12.1f}" for p in PERCENTILES)
+        old = old_rows.get(name)
+        if old and old.get("p50"):
+            line += f"   p50 {100 * (values['p50'] / old['p50'] - 1):+.0f}% vs {baseline['commit']}"
+        print(line)
+
+
+async def main_async(args) -> dict:
+    output_dir = tempfile.mkdtemp(prefix="bench_output_")
+    base_url = f"http://127.0.0.1:{args.port}"
+    backends = [(f"127.0.0.1:{args.port + i}", os.path.join(output_dir, f"backend_{i}")) for i in range(args.backends)]
+    fakes = [
+        subprocess.Popen([
+            sys.executable, "-m", "bench.fake_comfy",
+            "--port", str(args.port + i),
+            "--delay", str(args.delay),
+            "--output-dir", backend_output_dir,
+            "--output-size", str(args.output_size),
+        ])
+        for i, (_, backend_output_dir) in enumerate(backends)
+    ]
+    try:
+        for host, _ in backends:
+            await wait_for_server(f"http://{host}/system_stats")
+
+        # The image server is on loopback, which the SSRF guard rejects
+        image_io.validate_image_url = lambda url: None
+        Image.from_bytes = staticmethod(publish_locally)
+
+        app = object.__new__(handler.LightTransfer)
+        await app.connect(backends, result_cache_dir=os.path.join(output_dir, "results"))
+        try:
+            result = await run_requests(app, args, base_url)
+        finally:
+            for backend in app.pool.backends:
+                await backend.events.close()
+                await backend.client.aclose()
+            await app.remote_http.aclose()
+    finally:
+        for fake in fakes:
+            fake.terminate()
+            fake.wait()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    result["commit"] = git_commit()
+    result["python"] = platform.python_version()
+    result["settings"] = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "main_size": "{}x{}".format(*args.main_size),
+        "reference_size": "{}x{}".format(*args.reference_size),
+        "format": args.format,
+        "unique": args.unique,
+        "delay_s": args.delay,
+        "output_size": args.output_size,
+        "backends": args.backends,
+        "quality": args.quality,
+        "full_resolution": args.full_resolution,
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--main-size", type=parse_size, default=(1024, 768))
+    parser.add_argument("--reference-size", type=parse_size, default=(768, 768))
+    parser.add_argument("--format", choices=["jpg", "png", "webp"], default="jpg")
+    parser.add_argument("--unique", action="store_true", help="use a different main image for every request")
+    parser.add_argument("--delay", type=float, default=0.2, help="simulated seconds of inference per prompt")
+    parser.add_argument("--output-size", type=int, default=1024)
+    parser.add_argument("--port", type=int, default=8190, help="port of the first stand-in ComfyUI")
+    parser.add_argument("--backends", type=int, default=1, help="number of stand-in ComfyUI instances")
+    parser.add_argument("--quality", choices=list(handler.QUALITY_TIERS), default="standard")
+    parser.add_argument("--full-resolution", action="store_true", help="upsample results to the main image size")
+    parser.add_argument("--json", help="write the result to this file")
+    parser.add_argument("--baseline", help="compare with a result file from an earlier run")
+    parser.add_argument(
+        "--max-regression", type=float, default=None,
+        help="exit with an error if request p95 grew by more than this fraction over the baseline",
+    )
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if result["failed"]:
+        sys.exit(1)
+    if baseline and args.max_regression is not None:
+        old, new = baseline["latency_ms"]["p95"], result["latency_ms"]["p95"]
+        if new > old * (1 + args.max_regression):
+            print(f"Request p95 regressed from {old} ms to {new} ms")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
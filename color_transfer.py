@@ -0,0 +1,93 @@
+from io import BytesIO
+from typing import BinaryIO
+
+import numpy as np
+from PIL import Image as PILImage
+
+from image_io import _plan, _to_rgb
+
+# Linear sRGB to CIE XYZ, scaled by the D65 white point so white maps to (1, 1, 1)
+_RGB_TO_XYZ = np.array(
+    [[0.4124, 0.3576, 0.1805], [0.2126, 0.7152, 0.0722], [0.0193, 0.1192, 0.9505]], dtype=np.float32
+) / np.array([[0.95047], [1.0], [1.08883]], dtype=np.float32)
+_XYZ_TO_RGB = np.linalg.inv(_RGB_TO_XYZ).astype(np.float32)
+_DELTA = 6 / 29
+# sRGB decoding of every 8-bit value, so linearising is a table lookup
+_LINEAR = np.where(
+    np.arange(256) / 255 <= 0.04045, np.arange(256) / 255 / 12.92, ((np.arange(256) / 255 + 0.055) / 1.055) ** 2.4
+).astype(np.float32)
+# And sRGB encoding of linear values quantised to 12 bits, fine enough for 8-bit output
+_ENCODE_LEVELS = 4095
+_SRGB8 = np.round(
+    255 * np.where(
+        np.linspace(0, 1, _ENCODE_LEVELS + 1) <= 0.0031308,
+        np.linspace(0, 1, _ENCODE_LEVELS + 1) * 12.92,
+        1.055 * np.linspace(0, 1, _ENCODE_LEVELS + 1) ** (1 / 2.4) - 0.055,
+    )
+).astype(np.uint8)
+
+
+def load_small(content: BinaryIO, max_pixels: int, megapixels: float) -> np.ndarray:
+    """Decode an image as 8-bit RGB, no larger than ``megapixels``; JPEGs decode at reduced size."""
+    try:
+        pil = PILImage.open(content)
+        target = _plan(pil, max_pixels, megapixels, 1, "bilinear")
+        pil = _to_rgb(pil)
+        if pil.mode != "RGB":
+            pil = pil.convert("RGB")
+        if target is not None and pil.size != target:
+            pil = pil.resize(target, PILImage.Resampling.BILINEAR)
+        return np.asarray(pil)
+    except ValueError:
+        raise
+    except Exception as img_err:
+        raise ValueError(f"Invalid image format: {str(img_err)}")
+
+
+def _to_lab(rgb: np.ndarray) -> np.ndarray:
+    """8-bit RGB (h, w, 3) to CIELAB planes (3, h, w); planar keeps every step a contiguous BLAS or ufunc pass."""
+    linear = _LINEAR[rgb.transpose(2, 0, 1)]
+    f = np.tensordot(_RGB_TO_XYZ, linear, axes=1)
+    small = f <= _DELTA**3
+    linear_part = f[small] / (3 * _DELTA**2) + 4 / 29
+    np.cbrt(f, out=f)
+    f[small] = linear_part
+    return np.stack([116 * f[1] - 16, 500 * (f[0] - f[1]), 200 * (f[1] - f[2])])
+
+
+def _to_rgb8(lab: np.ndarray) -> np.ndarray:
+    """CIELAB planes (3, h, w) back to 8-bit RGB (h, w, 3)."""
+    fy = (lab[0] + 16) / 116
+    f = np.stack([fy + lab[1] / 500, fy, fy - lab[2] / 200])
+    small = f <= _DELTA
+    xyz = f**3
+    xyz[small] = 3 * _DELTA**2 * (f[small] - 4 / 29)
+    linear = np.tensordot(_XYZ_TO_RGB, xyz, axes=1)
+    np.clip(linear, 0, 1, out=linear)
+    levels = (linear * _ENCODE_LEVELS + 0.5).astype(np.int32)
+    return np.ascontiguousarray(_SRGB8[levels].transpose(1, 2, 0))
+
+
+def reinhard_transfer(main: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """Give ``main`` the colour and tone statistics of ``reference`` (Reinhard et al., 2001).
+
+    Each CIELAB channel of the main image is shifted and scaled to the mean
+    and standard deviation of the reference's; both are 8-bit RGB arrays.
+    """
+    main_lab = _to_lab(main)
+    # Statistics need far fewer pixels than the output does
+    reference_lab = _to_lab(reference[::2, ::2])
+    main_mean, main_std = main_lab.mean(axis=(1, 2)), main_lab.std(axis=(1, 2))
+    reference_mean, reference_std = reference_lab.mean(axis=(1, 2)), reference_lab.std(axis=(1, 2))
+    # Flat channels (e.g. a greyscale main image's chroma) are shifted but not stretched
+    gain = np.where(main_std > 1e-3, reference_std / np.maximum(main_std, 1e-3), 1).astype(np.float32)
+    offset = (reference_mean - main_mean * gain).astype(np.float32)
+    main_lab *= gain[:, None, None]
+    main_lab += offset[:, None, None]
+    return _to_rgb8(main_lab)
+
+
+def encode_preview(rgb: np.ndarray, quality: int = 85) -> bytes:
+    buf = BytesIO()
+    PILImage.fromarray(rgb).save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+
+import httpx
+import websockets
+
+
+class ComfyRejectedError(Exception):
+    """Raised when ComfyUI refuses to queue a prompt."""
+
+
+class ComfyClient:
+    """Async client for a ComfyUI server backed by one pooled keep-alive session."""
+
+    def __init__(
+        self,
+        host: str,
+        max_connections: int = 10,
+        timeout: float = 30,
+        output_dir: str | None = None,
+        input_dir: str | None = None,
+    ):
+        self.host = host
+        self.output_dir = output_dir
+        self.input_dir = input_dir
+        self.http = httpx.AsyncClient(
+            base_url=f"http://{host}",
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+
+    async def upload_image(self, name: str, data, content_type: str = "image/png", overwrite: bool = False) -> str:
+        """Upload raw image bytes or a readable buffer to the ComfyUI input folder.
+
+        Returns the stored file name, which ComfyUI changes on a name clash
+        unless ``overwrite`` is set.
+        """
+        files = {"image": (name, data, content_type)}
+        form = {"overwrite": "true"} if overwrite else None
+        r = await self.http.post("/upload/image", files=files, data=form)
+        r.raise_for_status()
+        return r.json()["name"]
+
+    async def queue_prompt(self, prompt_json: str, client_id: str, prompt_id: str | None = None) -> str:
+        """Queue a prompt given as pre-serialized JSON text and return its id."""
+        payload = f'{{"prompt":{prompt_json},"client_id":{json.dumps(client_id)}'
+        if prompt_id:
+            payload += f',"prompt_id":{json.dumps(prompt_id)}'
+        r = await self.http.post(
+            "/prompt", content=payload + "}", headers={"Content-Type": "application/json"}
+        )
+        if r.status_code != 200:
+            raise ComfyRejectedError(r.text)
+        return r.json()["prompt_id"]
+
+    async def get_queue(self) -> dict:
+        """Return ComfyUI's ``queue_running`` and ``queue_pending`` lists."""
+        r = await self.http.get("/queue")
+        r.raise_for_status()
+        return r.json()
+
+    async def delete_queued(self, prompt_ids: list[str]):
+        """Remove prompts from the pending queue; ids that are not pending are ignored."""
+        r = await self.http.post("/queue", json={"delete": prompt_ids})
+        r.raise_for_status()
+
+    async def interrupt(self, prompt_id: str):
+        """Stop the running prompt.
+
+        ComfyUI versions that understand ``prompt_id`` only interrupt that
+        prompt; older ones stop whatever is running.
+        """
+        r = await self.http.post("/interrupt", json={"prompt_id": prompt_id})
+        r.raise_for_status()
+
+    def delete_input(self, name: str) -> bool:
+        """Delete an uploaded image from the input directory if it is on this machine.
+
+        ComfyUI has no endpoint for this, so without ``input_dir`` nothing is
+        deleted. Returns whether a file was removed.
+        """
+        if not self.input_dir:
+            return False
+        try:
+            os.remove(os.path.join(self.input_dir, name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete_output(self, image: dict) -> bool:
+        """Delete an output image once it has been read, if the output directory is on this machine."""
+        if not self.output_dir or image.get("type") != "output":
+            return False
+        try:
+            os.remove(os.path.join(self.output_dir, image.get("subfolder", ""), image["filename"]))
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def get_history(self, prompt_id: str) -> dict:
+        r = await self.http.get(f"/history/{prompt_id}")
+        r.raise_for_status()
+        return r.json()
+
+    async def view(self, filename: str, subfolder: str = "", folder_type: str = "output") -> bytes:
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        r = await self.http.get("/view", params=params)
+        r.raise_for_status()
+        return r.content
+
+    async def read_output(self, image: dict) -> bytes:
+        """Return the bytes of an output image reference from an executed message.
+
+        Files are read straight from the output directory when it is on this
+        machine, falling back to ``/view`` otherwise.
+        """
+        if self.output_dir and image.get("type") == "output":
+            path = os.path.join(self.output_dir, image.get("subfolder", ""), image["filename"])
+            try:
+                return await asyncio.to_thread(_read_file, path)
+            except OSError:
+                pass
+        return await self.view(image["filename"], image.get("subfolder", ""), image["type"])
+
+    def connect_ws(self, client_id: str):
+        """Open the ComfyUI event websocket; use as an async context manager."""
+        return websockets.connect(f"ws://{self.host}/ws?clientId={client_id}", max_size=None)
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
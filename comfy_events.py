@@ -0,0 +1,190 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+
+from comfy_client import ComfyClient
+
+
+class ComfyExecutionError(Exception):
+    """Raised when ComfyUI reports that a prompt failed or was interrupted."""
+
+
+class ComfyCrashedError(ComfyExecutionError):
+    """Raised for prompts that were queued or running when ComfyUI died; safe to retry later."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PromptRun:
+    """Events received for one prompt, completed when ComfyUI finishes it."""
+
+    def __init__(self, prompt_id: str):
+        self.prompt_id = prompt_id
+        self.outputs: dict[str, list] = {}
+        self.cached_nodes: list = []
+        # perf_counter timestamps and per-node durations derived from executing events
+        self.started_at = None
+        self.finished_at = None
+        self.node_seconds: dict[str, float] = {}
+        self._current_node = None
+        self.done = asyncio.get_running_loop().create_future()
+
+    def node_started(self, node_id: str | None):
+        now = time.perf_counter()
+        if self.started_at is None:
+            self.started_at = now
+        if self._current_node is not None:
+            node, since = self._current_node
+            self.node_seconds[node] = self.node_seconds.get(node, 0.0) + now - since
+        self._current_node = (node_id, now) if node_id is not None else None
+
+    def finish(self):
+        if not self.done.done():
+            self.node_started(None)
+            self.finished_at = time.perf_counter()
+            self.done.set_result(self.outputs)
+
+    def fail(self, error: Exception):
+        if not self.done.done():
+            self.node_started(None)
+            self.finished_at = time.perf_counter()
+            self.done.set_exception(error)
+            # Nobody may be awaiting a run that was never tracked
+            self.done.exception()
+
+
+class ComfyEventStream:
+    """One long-lived ComfyUI websocket whose events are routed by prompt_id.
+
+    Requests register a :class:`PromptRun` with :meth:`track` and await its
+    ``done`` future instead of reading a socket of their own. The connection
+    is re-established with backoff when it drops, and prompts that finished
+    in the meantime are resolved from ``/history``.
+    """
+
+    def __init__(self, comfy: ComfyClient, max_runs: int = 256):
+        self.comfy = comfy
+        self.client_id = str(uuid.uuid4())
+        self.max_runs = max_runs
+        self.queue_remaining = 0
+        self._runs: OrderedDict[str, PromptRun] = OrderedDict()
+        self._tracked: set[str] = set()
+        self._connected = asyncio.Event()
+        self._task = None
+
+    async def start(self, timeout: float = 30):
+        self._task = asyncio.create_task(self._run())
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def track(self, prompt_id: str) -> PromptRun:
+        """Start routing events for ``prompt_id``; call before queueing it."""
+        self._tracked.add(prompt_id)
+        return self._get_run(prompt_id)
+
+    def untrack(self, prompt_id: str):
+        self._tracked.discard(prompt_id)
+        self._runs.pop(prompt_id, None)
+
+    def fail_all(self, error: Exception):
+        """Fail every tracked prompt that has not finished, e.g. because ComfyUI died."""
+        for prompt_id in list(self._tracked):
+            run = self._runs.get(prompt_id)
+            if run is not None:
+                run.fail(error)
+
+    def _get_run(self, prompt_id: str) -> PromptRun:
+        run = self._runs.get(prompt_id)
+        if run is None:
+            run = self._runs[prompt_id] = PromptRun(prompt_id)
+            # Bound the runs kept for prompts nobody is waiting on
+            while len(self._runs) > self.max_runs:
+                stale = next((pid for pid in self._runs if pid not in self._tracked), None)
+                if stale is None:
+                    break
+                del self._runs[stale]
+        return run
+
+    async def _run(self):
+        delay = 0.5
+        while True:
+            try:
+                async with self.comfy.connect_ws(self.client_id) as ws:
+                    self._connected.set()
+                    delay = 0.5
+                    await self._recover()
+                    async for raw in ws:
+                        # Binary frames are previews; only JSON text frames carry status
+                        if isinstance(raw, str):
+                            self._dispatch(json.loads(raw))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"ComfyUI websocket error: {e}")
+            self._connected.clear()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
+
+    async def _recover(self):
+        """Resolve tracked prompts that finished while the socket was down."""
+        for prompt_id in list(self._tracked):
+            run = self._runs.get(prompt_id)
+            if run is None or run.done.done():
+                continue
+            try:
+                history = await self.comfy.get_history(prompt_id)
+            except Exception as e:
+                print(f"Failed to recover prompt {prompt_id}: {e}")
+                continue
+            entry = history.get(prompt_id)
+            if not entry:
+                continue  # still queued or running; its events will arrive
+            status = entry.get("status", {})
+            if status.get("status_str") == "error":
+                run.fail(ComfyExecutionError(f"Prompt {prompt_id} failed while disconnected"))
+            elif status.get("completed", True):
+                for node_id, output in entry.get("outputs", {}).items():
+                    run.outputs[node_id] = output.get("images", [])
+                run.finish()
+
+    def _dispatch(self, msg: dict):
+        msg_type = msg.get("type")
+        data = msg.get("data") or {}
+        if msg_type == "status":
+            self.queue_remaining = data.get("status", {}).get("exec_info", {}).get("queue_remaining", 0)
+            return
+
+        prompt_id = data.get("prompt_id")
+        if prompt_id is None:
+            return
+        run = self._get_run(prompt_id)
+
+        if msg_type == "execution_start":
+            run.node_started(None)
+        elif msg_type == "executed":
+            run.outputs[data.get("node")] = (data.get("output") or {}).get("images", [])
+        elif msg_type == "execution_cached":
+            run.cached_nodes = data.get("nodes", [])
+        elif msg_type == "execution_success":
+            run.finish()
+        elif msg_type == "executing":
+            if data.get("node") is None:
+                run.finish()
+            else:
+                run.node_started(data["node"])
+        elif msg_type == "execution_error":
+            detail = data.get("exception_message") or "unknown error"
+            run.fail(ComfyExecutionError(f"{data.get('node_type', 'node')} {data.get('node_id', '')} failed: {detail}"))
+        elif msg_type == "execution_interrupted":
+            run.fail(ComfyExecutionError("Prompt execution was interrupted"))
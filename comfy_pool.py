@@ -0,0 +1,66 @@
+from contextlib import asynccontextmanager
+
+from comfy_client import ComfyClient
+from comfy_events import ComfyEventStream
+from scheduler import OverloadedError, PromptScheduler
+
+
+class ComfyBackend:
+    """One ComfyUI instance with the client, event stream and scheduler bound to it.
+
+    A request is pinned to the backend it was admitted on: its uploads,
+    prompt, history and output reads all go to the same instance.
+    """
+
+    def __init__(self, client: ComfyClient, events: ComfyEventStream, scheduler: PromptScheduler):
+        self.client = client
+        self.events = events
+        self.scheduler = scheduler
+
+    @property
+    def name(self) -> str:
+        return self.client.host
+
+
+class ComfyPool:
+    """ComfyUI backends on one worker, with requests routed to the least loaded.
+
+    Load is the work this worker admitted to a backend and has not finished,
+    weighted by that backend's average prompt time. Backends whose scheduler
+    is paused (restarting) are skipped.
+    """
+
+    def __init__(self, backends: list[ComfyBackend]):
+        if not backends:
+            raise ValueError("A pool needs at least one backend")
+        self.backends = backends
+
+    def pick(self, lane: str | None = None) -> ComfyBackend:
+        """The healthy backend expected to start new work in ``lane`` soonest."""
+        healthy = [backend for backend in self.backends if backend.scheduler.paused is None]
+        if not healthy:
+            reason, retry_after = min((b.scheduler.paused for b in self.backends), key=lambda p: p[1])
+            raise OverloadedError(f"No ComfyUI backend is available: {reason}", retry_after)
+        return min(healthy, key=lambda backend: backend.scheduler.expected_wait(lane))
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        prompts: int,
+        budget: float,
+        required: int | None = None,
+        cost: float = 1.0,
+        lane: str | None = None,
+    ):
+        """Admit a request on the least loaded backend; yields the backend and its ticket.
+
+        See :meth:`PromptScheduler.admit` for the arguments and the errors raised.
+        """
+        backend = self.pick(lane)
+        async with backend.scheduler.admit(prompts, budget, required, cost, lane) as ticket:
+            yield backend, ticket
+
+    @property
+    def queue_remaining(self) -> int:
+        """Prompts queued or running across all backends, as last reported by ComfyUI."""
+        return sum(backend.events.queue_remaining for backend in self.backends)
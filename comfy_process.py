@@ -0,0 +1,96 @@
+import subprocess
+import threading
+import time
+from collections import deque
+
+import requests
+
+# Printed by ComfyUI once its HTTP server is listening
+READY_MARKER = "To see the GUI go to"
+
+
+class ComfyProcess:
+    """ComfyUI server subprocess with its output drained by a reader thread.
+
+    Readiness is signalled by the server's own startup log line rather than
+    by polling; the health endpoint is only probed to confirm it. The last
+    ``log_lines`` lines of output are kept for diagnostics.
+    """
+
+    def __init__(self, command: list, host: str, log_lines: int = 500):
+        self.command = command
+        self.host = host
+        self.proc = None
+        self.started_at = None
+        self.ready_at = None
+        self.log = deque(maxlen=log_lines)
+        self._ready = threading.Event()
+
+    def start(self):
+        self._ready.clear()
+        self.started_at = time.perf_counter()
+        self.ready_at = None
+        self.proc = subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            text=True,
+            errors="replace",
+            bufsize=1,
+        )
+        threading.Thread(target=self._drain, args=(self.proc,), daemon=True).start()
+
+    def _drain(self, proc):
+        # The pipe must be read continuously or ComfyUI blocks on a full buffer
+        for line in proc.stdout:
+            self.log.append(line.rstrip("\n"))
+            if not self._ready.is_set() and READY_MARKER in line:
+                self._ready.set()
+        self._ready.set()  # wake waiters; they notice the exit via poll()
+
+    def stop(self, timeout: float = 10):
+        """Terminate the server, killing it if it does not exit within ``timeout``."""
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+    def log_tail(self, lines: int = 20) -> str:
+        """The last ``lines`` lines ComfyUI printed."""
+        return "\n".join(list(self.log)[-lines:])
+
+    def is_healthy(self) -> bool:
+        try:
+            return requests.get(f"http://{self.host}/system_stats", timeout=5).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def wait_ready(self, timeout: float) -> bool:
+        """Block until ComfyUI serves requests; False if it exits or times out."""
+        deadline = time.monotonic() + timeout
+        # Probe with a growing interval only as a fallback in case the log marker changes
+        fallback_delay = 1.0
+        while time.monotonic() < deadline:
+            signalled = self._ready.wait(min(fallback_delay, max(deadline - time.monotonic(), 0)))
+            if self.proc.poll() is not None:
+                print(f"ComfyUI exited during startup with code {self.proc.returncode}")
+                return False
+            if self.is_healthy():
+                self.ready_at = time.perf_counter()
+                return True
+            if signalled:
+                # Marker seen but the socket is not answering yet
+                time.sleep(0.05)
+            fallback_delay = min(fallback_delay * 2, 10)
+        return False
+
+    @property
+    def boot_seconds(self) -> float | None:
+        if self.ready_at is None:
+            return None
+        return self.ready_at - self.started_at
@@ -0,0 +1,90 @@
+import asyncio
+import math
+import subprocess
+from typing import Awaitable, Callable
+
+import metrics
+from comfy_events import ComfyCrashedError, ComfyEventStream
+from comfy_process import ComfyProcess
+from scheduler import PromptScheduler
+
+
+class ComfySupervisor:
+    """Watches the ComfyUI process and restarts it when it dies or hangs.
+
+    A crash is noticed as soon as the process exits, a hang after
+    ``max_health_failures`` failed health checks ``health_interval`` seconds
+    apart. Prompts in flight are then failed at once instead of waiting for
+    their timeout, new work is rejected as retryable, and ComfyUI is
+    restarted with exponential backoff and warmed up again before the
+    scheduler resumes.
+    """
+
+    def __init__(
+        self,
+        process: ComfyProcess,
+        events: ComfyEventStream,
+        scheduler: PromptScheduler,
+        warm_up: Callable[[], Awaitable],
+        start_timeout: float,
+        health_interval: float = 10,
+        max_health_failures: int = 3,
+        max_backoff: float = 60,
+    ):
+        self.process = process
+        self.events = events
+        self.scheduler = scheduler
+        self.warm_up = warm_up
+        self.start_timeout = start_timeout
+        self.health_interval = health_interval
+        self.max_health_failures = max_health_failures
+        self.max_backoff = max_backoff
+
+    async def run(self):
+        metrics.COMFY_UP.labels(backend=self.process.host).set(1)
+        while True:
+            kind, reason = await self._watch()
+            metrics.COMFY_UP.labels(backend=self.process.host).set(0)
+            metrics.COMFY_RESTARTS.labels(backend=self.process.host, reason=kind).inc()
+            print(f"ComfyUI at {self.process.host} {reason}; last output:\n{self.process.log_tail()}")
+
+            # Requests waiting on ComfyUI learn now rather than at their timeout
+            retry_after = math.ceil((self.process.boot_seconds or 60) + self.health_interval)
+            self.scheduler.pause(f"ComfyUI {reason} and is restarting", retry_after)
+            self.events.fail_all(ComfyCrashedError(f"ComfyUI {reason}: {self.process.log_tail(3)}", retry_after))
+
+            await self._restart()
+            self.scheduler.resume()
+            metrics.COMFY_UP.labels(backend=self.process.host).set(1)
+
+    async def _watch(self) -> tuple[str, str]:
+        """Wait until ComfyUI exits or stops answering; returns a metrics label and what happened."""
+        failures = 0
+        while True:
+            try:
+                code = await asyncio.to_thread(self.process.proc.wait, self.health_interval)
+                return "exited", f"exited with code {code}"
+            except subprocess.TimeoutExpired:
+                pass
+            if await asyncio.to_thread(self.process.is_healthy):
+                failures = 0
+                continue
+            failures += 1
+            if failures >= self.max_health_failures:
+                return "unresponsive", f"stopped responding to {failures} health checks"
+
+    async def _restart(self):
+        delay = 1.0
+        while True:
+            await asyncio.to_thread(self.process.stop)
+            self.process.start()
+            if await asyncio.to_thread(self.process.wait_ready, self.start_timeout):
+                try:
+                    await self.warm_up()
+                    print(f"ComfyUI at {self.process.host} restarted in {self.process.boot_seconds:.1f}s")
+                    return
+                except Exception as e:
+                    print(f"ComfyUI at {self.process.host} failed to warm up after restarting: {e}")
+            print(f"ComfyUI at {self.process.host} failed to restart, retrying in {delay:.0f}s; last output:\n{self.process.log_tail()}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_backoff)
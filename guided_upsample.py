@@ -0,0 +1,181 @@
+from io import BytesIO
+from typing import BinaryIO
+
+import numpy as np
+from PIL import Image as PILImage
+
+from image_io import _to_rgb, total_pixels_size
+
+# Window radius (in result pixels) and regularisation of the local colour fit
+RADIUS = 4
+EPS = 1e-4
+# Full-resolution pixels processed at once; bounds the float working set per tile
+TILE_PIXELS = 1 << 19
+# Working memory per pixel: the decoded original (RGB, plus a converted copy) and the PNG being written
+FULL_BYTES_PER_PIXEL = 10
+# Per result pixel: guided filter statistics and coefficients, float32
+RESULT_BYTES_PER_PIXEL = 256
+# The VAE encodes whole blocks of this many pixels, centre-cropping the scaled input to fit
+VAE_BLOCK = 8
+
+
+def _box(x: np.ndarray, radius: int) -> np.ndarray:
+    """Mean over a (2r+1)² window, shrunk at the borders, for arrays shaped (h, w, ...)."""
+    out = x
+    for axis in (0, 1):
+        n = out.shape[axis]
+        padded = np.concatenate(
+            [np.zeros_like(out.take([0], axis=axis)), np.cumsum(out, axis=axis, dtype=np.float32)], axis=axis
+        )
+        hi = np.minimum(np.arange(n) + radius + 1, n)
+        lo = np.maximum(np.arange(n) - radius, 0)
+        shape = [1] * out.ndim
+        shape[axis] = n
+        out = (padded.take(hi, axis=axis) - padded.take(lo, axis=axis)) / (hi - lo).reshape(shape).astype(np.float32)
+    return out
+
+
+def _inverse_symmetric(m: np.ndarray) -> np.ndarray:
+    """Inverse of a stack of symmetric positive definite 3x3 matrices, by cofactors.
+
+    Several times faster than a batched ``np.linalg.solve`` for this size.
+    """
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m11, m12, m22 = m[..., 1, 1], m[..., 1, 2], m[..., 2, 2]
+    c00 = m11 * m22 - m12 * m12
+    c01 = m02 * m12 - m01 * m22
+    c02 = m01 * m12 - m02 * m11
+    c11 = m00 * m22 - m02 * m02
+    c12 = m01 * m02 - m00 * m12
+    c22 = m00 * m11 - m01 * m01
+    det = m00 * c00 + m01 * c01 + m02 * c02
+    inverse = np.stack([c00, c01, c02, c01, c11, c12, c02, c12, c22], axis=-1)
+    inverse /= det[..., None]
+    return inverse.reshape(m.shape)
+
+
+def _fit(guide: np.ndarray, target: np.ndarray, radius: int, eps: float) -> np.ndarray:
+    """Colour guided filter: per pixel, the affine map from ``guide`` to ``target`` RGB.
+
+    Returns coefficients shaped (h, w, 12), least-squares fitted over each
+    window: for each guide channel k its weights in the three output
+    channels at ``3k:3k+3``, then the offset at ``9:12``.
+    """
+    mean_i = _box(guide, radius)
+    mean_p = _box(target, radius)
+    outer_ii = guide[..., :, None] * guide[..., None, :]
+    cov_ii = _box(outer_ii, radius) - mean_i[..., :, None] * mean_i[..., None, :]
+    del outer_ii
+    outer_ip = guide[..., :, None] * target[..., None, :]
+    cov_ip = _box(outer_ip, radius) - mean_i[..., :, None] * mean_p[..., None, :]
+    del outer_ip
+
+    cov_ii += eps * np.eye(3, dtype=np.float32)
+    # a[..., k, c]: weight of guide channel k in output channel c
+    a = np.matmul(_inverse_symmetric(cov_ii), cov_ip)
+    b = mean_p - np.einsum("...kc,...k->...c", a, mean_i)
+    h, w = guide.shape[:2]
+    coefficients = np.concatenate([a.reshape(h, w, 9), b], axis=-1)
+    # Averaging the overlapping windows' fits keeps the result smooth
+    return _box(coefficients, radius)
+
+
+def covered_box(size: tuple[int, int], result_size: tuple[int, int], scale: dict | None) -> tuple:
+    """The region of an image of ``size`` that the workflow output covers, in its pixels.
+
+    The workflow scales the image as ``scale`` describes (see
+    :meth:`WorkflowTemplate.input_scale`), then the VAE centre-crops it to
+    whole blocks. If that does not yield ``result_size`` the workflow is
+    assumed to cover the whole image.
+    """
+    width, height = size
+    scaled = total_pixels_size(width, height, scale["megapixels"], scale["resolution_steps"]) if scale else size
+    cropped = tuple(n // VAE_BLOCK * VAE_BLOCK for n in scaled)
+    if cropped != tuple(result_size):
+        return (0, 0, width, height)
+    left, top = ((n - c) // 2 for n, c in zip(scaled, cropped))
+    fx, fy = width / scaled[0], height / scaled[1]
+    return (left * fx, top * fy, (left + cropped[0]) * fx, (top + cropped[1]) * fy)
+
+
+def upsample_memory(original: BinaryIO, result: bytes) -> int:
+    """Estimate the working memory :func:`guided_upsample` needs, from the image headers."""
+    try:
+        with PILImage.open(original) as pil:
+            full = pil.size[0] * pil.size[1]
+        with PILImage.open(BytesIO(result)) as pil:
+            low = pil.size[0] * pil.size[1]
+    finally:
+        original.seek(0)
+    return full * FULL_BYTES_PER_PIXEL + low * RESULT_BYTES_PER_PIXEL
+
+
+def guided_upsample(
+    original: BinaryIO, result: bytes, scale: dict | None = None, radius: int = RADIUS, eps: float = EPS
+) -> bytes:
+    """Carry the lighting and colour of ``result`` over to the full-size ``original``; returns PNG bytes.
+
+    ``result`` is the workflow output for ``original`` scaled down to about
+    a megapixel as ``scale`` describes, and cropped by the VAE (see
+    :func:`covered_box`). For every result pixel a guided filter fits the
+    affine colour transform that takes the same region of the original,
+    downscaled, to the result (this covers a luminance gain plus chroma
+    shift, and hue rotations too). Those coefficients vary slowly, so they
+    are upsampled bilinearly and applied to the original's own pixels,
+    which keeps its full-resolution detail; the few pixels the crop left
+    out take the nearest coefficients. The full-size image is processed in
+    tiles of rows, in place.
+    """
+    with PILImage.open(BytesIO(result)) as pil:
+        relit = np.asarray(pil.convert("RGB"), dtype=np.float32) / 255
+    height, width = relit.shape[:2]
+
+    with PILImage.open(original) as pil:
+        pil = _to_rgb(pil)
+        if pil.mode != "RGB":
+            pil = pil.convert("RGB")
+        # A guide misaligned with the result by even a pixel would be fitted as halos and doubled edges
+        left, top, right, bottom = covered_box(pil.size, (width, height), scale)
+        guide = pil.resize((width, height), PILImage.Resampling.BOX, box=(left, top, right, bottom))
+        guide = np.asarray(guide, dtype=np.float32) / 255
+        full = np.array(pil)
+    coefficients = _fit(guide, relit, radius, eps)
+    del guide, relit
+
+    # One float image per coefficient, so Pillow can interpolate any band of rows; padded with
+    # their edges so the pixels outside the covered region can be interpolated too
+    coefficients = np.pad(coefficients, ((VAE_BLOCK, VAE_BLOCK), (VAE_BLOCK, VAE_BLOCK), (0, 0)), mode="edge")
+    planes = [PILImage.fromarray(np.ascontiguousarray(coefficients[..., i])) for i in range(12)]
+    del coefficients
+    full_height, full_width = full.shape[:2]
+    scale_x, scale_y = width / (right - left), height / (bottom - top)
+    # Columns are the same for every tile, clamped in case rounding reaches past the padding
+    x0 = max(VAE_BLOCK - left * scale_x, 0)
+    x1 = min(VAE_BLOCK + (full_width - left) * scale_x, width + 2 * VAE_BLOCK)
+    rows_per_tile = max(1, TILE_PIXELS // full_width)
+    for row in range(0, full_height, rows_per_tile):
+        end = min(row + rows_per_tile, full_height)
+        box = (
+            x0,
+            max(VAE_BLOCK + (row - top) * scale_y, 0),
+            x1,
+            min(VAE_BLOCK + (end - top) * scale_y, height + 2 * VAE_BLOCK),
+        )
+
+        def plane(i: int) -> np.ndarray:
+            return np.asarray(planes[i].resize((full_width, end - row), PILImage.Resampling.BILINEAR, box=box))
+
+        pixels = full[row:end].astype(np.float32)
+        for c in range(3):
+            # The offset, plus each guide channel times its weight in this output channel
+            out = plane(9 + c) * 255
+            for k in range(3):
+                out += plane(3 * k + c) * pixels[..., k]
+            out += 0.5
+            np.clip(out, 0, 255, out=out)
+            full[row:end, :, c] = out
+
+    buf = BytesIO()
+    # Full-size PNGs are slow to compress; favour encode speed like the uploads to ComfyUI do
+    PILImage.fromarray(full).save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
@@ -1,23 +1,47 @@
 import fal
 from fal.container import ContainerImage
 from fal.toolkit import Image
+from fal.toolkit.image import ImageSize
 from pathlib import Path
-from fastapi import Response, HTTPException
+from fastapi import Request, Response, HTTPException
 import json
+import math
 import uuid
 import base64
-import requests
-import websocket
+import asyncio
+import functools
+import httpx
 import traceback
 import os
-import copy
 import random
+import re
 import tempfile
+import time
+from typing import BinaryIO, Literal
+from contextlib import asynccontextmanager, contextmanager
 from io import BytesIO
+import metrics
 from PIL import Image as PILImage
 from pydantic import BaseModel, Field
+from color_transfer import encode_preview, load_small, reinhard_transfer
+from comfy_client import ComfyClient, ComfyRejectedError
+from comfy_events import ComfyCrashedError, ComfyEventStream, ComfyExecutionError
 from comfy_models import MODEL_LIST
-from workflow import WORKFLOW_JSON
+from comfy_pool import ComfyBackend, ComfyPool
+from comfy_process import ComfyProcess
+from comfy_supervisor import ComfySupervisor
+from guided_upsample import guided_upsample, upsample_memory
+from image_cache import InputImageCache, StagedImage
+from image_io import check_full_size, decode_memory
+from janitor import DirectoryJanitor
+from memory_budget import MemoryBudget
+from model_download import download_models
+from model_manifest import ModelManifest, verify_models
+from result_cache import ResultCache, result_key
+from scheduler import OverloadedError, PromptScheduler, Ticket
+from single_flight import SingleFlight
+from timing import PhaseTimer, activate, active_timer, span
+from workflow_compiler import LIGHT_TRANSFER
 
 # -------------------------------------------------
 # Container setup
@@ -26,7 +50,57 @@ PWD = Path(__file__).resolve().parent
 dockerfile_path = f"{PWD}/Dockerfile"
 custom_image = ContainerImage.from_dockerfile(dockerfile_path)
 
-COMFY_HOST = "127.0.0.1:8188"
+# Each instance loads its own copy of the models; more than one needs the GPU memory for it
+COMFY_INSTANCES = 1
+COMFY_BASE_PORT = 8188
+COMFY_COMMAND = [
+    "python", "-u", "/comfyui/main.py",
+    "--disable-auto-launch",
+    "--disable-metadata",
+    "--listen"
+]
+COMFY_START_TIMEOUT = 300
+WARMUP_TIMEOUT = 600
+COMFY_OUTPUT_DIR = "/comfyui/output"
+COMFY_INPUT_DIR = "/comfyui/input"
+COMFY_MAX_CONNECTIONS = 10
+REMOTE_MAX_CONNECTIONS = 20
+REQUEST_TIMEOUT = 240
+MAX_BATCH_SIZE = 25
+BATCH_TIMEOUT = 280
+PREP_CONCURRENCY = 4
+GPU_QUEUE_DEPTH = 2
+INITIAL_PROMPT_SECONDS = 20
+MODEL_MANIFEST_PATH = "/data/models/manifest.json"
+INPUT_CACHE_DIR = "/tmp/light_transfer/input_cache"
+INPUT_CACHE_MAX_BYTES = 2 * 1024**3
+MAX_INPUT_PIXELS = 64_000_000
+DECODE_MEMORY_BUDGET = 4 * 1024**3
+RESULT_CACHE_DIR = "/data/light_transfer/result_cache"
+RESULT_CACHE_MAX_BYTES = 10 * 1024**3
+MAX_SEED = 2**63 - 1
+DISCONNECT_POLL_INTERVAL = 1.0
+OUTPUT_RETENTION = 30
+JANITOR_INTERVAL = 300
+JANITOR_MAX_AGE = 900
+COMFY_DIR_MAX_BYTES = 4 * 1024**3
+# Content-addressed uploads are named by their sha256, plus the warm-up images
+UPLOAD_NAME_PATTERN = r"[0-9a-f]{64}|warmup_"
+# Seconds each priority lane's requests are ranked behind "interactive" ones for
+# GPU queue slots; bulk work that has waited this long goes ahead, so it never starves
+PRIORITY_LANES = {"interactive": 0, "bulk": 60}
+# /preview works on copies this small, so it answers in tens of milliseconds on the CPU
+PREVIEW_MEGAPIXELS = 0.25
+PREVIEW_BILLABLE_UNITS = 0.01
+# Workflow parameters per quality tier; "standard" runs the workflow as saved.
+# Tiers only change the resolution: the Lightning LoRA is distilled for exactly
+# its 8 steps, and other step counts gain nothing or degrade the result.
+# Draft latents snap to 16px so the smaller image still lines up with the VAE.
+QUALITY_TIERS = {
+    "draft": {"megapixels": 0.5, "resolution_steps": 16},
+    "standard": {},
+    "high": {"megapixels": 1.5},
+}
 
 # -------------------------------------------------
 # Utilities
@@ -34,28 +108,43 @@ COMFY_HOST = "127.0.0.1:8188"
 def ensure_dir(path):
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
-def download_if_missing(url, path):
-    if os.path.exists(path):
-        return
-    ensure_dir(path)
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(path, "wb") as f:
-            for chunk in r.iter_content(8192):
-                f.write(chunk)
-
-def check_server(url, retries=500, delay=0.1):
-    import time
-    for _ in range(retries):
-        try:
-            if requests.get(url, timeout=5).status_code == 200:
-                return True
-        except (requests.RequestException, Exception) as e:
-            # Log but continue retrying
-            if _ == retries - 1:
-                print(f"Server check failed after {retries} attempts: {e}")
-        time.sleep(delay)
-    return False
+def comfy_instance(index: int) -> tuple[list, str, str]:
+    """Command line, host and output folder of the ``index``-th ComfyUI instance."""
+    port = COMFY_BASE_PORT + index
+    # Instances share the input folder, whose names are content-addressed, but
+    # not the output folder: they would race for SaveImage's file counter
+    output_dir = COMFY_OUTPUT_DIR if index == 0 else f"{COMFY_OUTPUT_DIR}_{index}"
+    command = COMFY_COMMAND + ["--port", str(port), "--output-directory", output_dir]
+    return command, f"127.0.0.1:{port}", output_dir
+
+def quality_costs(tiers: dict) -> dict:
+    """Check each tier against the workflow and return its GPU cost relative to "standard".
+
+    Tiers keep the step count the workflow's LoRA is distilled for, so
+    sampling time grows with the pixels sampled. That sets both how long
+    the scheduler expects a prompt to take and how many units it bills.
+    """
+    costs = {}
+    for tier, values in tiers.items():
+        LIGHT_TRANSFER.render(**values)  # raises ValueError on parameters the workflow lacks
+        if "steps" in values:
+            raise ValueError(f"Quality tier {tier!r} must keep the workflow's {LIGHT_TRANSFER.defaults['steps']} steps")
+        megapixels = values.get("megapixels", LIGHT_TRANSFER.defaults["megapixels"])
+        costs[tier] = round(megapixels / LIGHT_TRANSFER.defaults["megapixels"], 2)
+    return costs
+
+QUALITY_COSTS = quality_costs(QUALITY_TIERS)
+
+def output_key(main_digest: str, reference_digest: str, quality: str, seed: int | None) -> str:
+    """Key of the workflow output for two images, in the result cache and in flight.
+
+    Without a seed it stands for any output of those inputs, so identical
+    seedless requests in flight can share one.
+    """
+    return result_key(
+        main_image=main_digest, reference_image=reference_digest, workflow=LIGHT_TRANSFER.digest,
+        **QUALITY_TIERS[quality], **({} if seed is None else {"seed": seed}),
+    )
 
 def fal_image_to_base64(img: Image) -> str:
     pil = img.to_pil()
@@ -63,111 +152,276 @@ def fal_image_to_base64(img: Image) -> str:
     pil.save(buf, format="PNG")
     return base64.b64encode(buf.getvalue()).decode()
 
-def validate_image_url(url: str):
-    """Validate image URL to prevent SSRF attacks."""
-    from urllib.parse import urlparse
-    import ipaddress
-    
-    parsed = urlparse(url)
-    
-    # Only allow http/https
-    if parsed.scheme not in ['http', 'https']:
-        raise ValueError(f"Invalid URL scheme: {parsed.scheme}. Only http/https allowed.")
-    
-    # Check hostname
-    hostname = parsed.hostname
-    if not hostname:
-        raise ValueError("Invalid URL: missing hostname")
-    
-    # Prevent localhost/private IP access
-    hostname_lower = hostname.lower()
-    if hostname_lower in ['localhost', 'localhost.localdomain']:
-        raise ValueError("Access to localhost not allowed")
-    
-    # Check for private IP addresses
+def record_run_timings(run, submitted_at: float, class_types: dict):
+    """Add queue wait, execution and per-node times of a finished prompt to the request timer."""
+    timer = active_timer()
+    if timer is not None and run.started_at is not None:
+        # execution_start can arrive before the /prompt response does
+        timer.record("queue_wait", max(run.started_at - submitted_at, 0.0))
+        timer.record("execute", run.finished_at - run.started_at)
+    for node_id, seconds in run.node_seconds.items():
+        if timer is not None:
+            timer.record(f"node_{node_id}", seconds)
+        metrics.NODE_SECONDS.labels(node=node_id, class_type=class_types.get(node_id, "unknown")).observe(seconds)
+
+# Cleanup tasks that must outlive the request that started them
+_background_tasks = set()
+
+def in_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def cancel_prompt(comfy: ComfyClient, prompt_id: str, reason: str):
+    """Withdraw a prompt nobody waits for: drop it from the queue, or interrupt it if it is running."""
     try:
-        ip = ipaddress.ip_address(hostname)
-        if ip.is_private or ip.is_loopback or ip.is_reserved:
-            raise ValueError(f"Access to private IP addresses not allowed: {hostname}")
-    except ValueError:
-        # Not an IP address, check for common private patterns
-        if any(hostname_lower.startswith(prefix) for prefix in ['192.168.', '10.', '172.16.', '172.17.', '172.18.', '172.19.', '172.20.', '172.21.', '172.22.', '172.23.', '172.24.', '172.25.', '172.26.', '172.27.', '172.28.', '172.29.', '172.30.', '172.31.']):
-            raise ValueError(f"Access to private networks not allowed: {hostname}")
-
-def image_url_to_base64(image_url: str, max_size_mb: int = 50) -> str:
-    """Download image from URL and convert to base64 with validation."""
-    validate_image_url(image_url)
-    
-    # Add retry logic for transient failures
-    max_retries = 3
-    for attempt in range(max_retries):
+        await comfy.delete_queued([prompt_id])
+        queue = await comfy.get_queue()
+        if any(entry[1] == prompt_id for entry in queue.get("queue_running", [])):
+            await comfy.interrupt(prompt_id)
+        metrics.CANCELLED_PROMPTS.labels(reason=reason).inc()
+    except Exception as e:
+        print(f"Failed to cancel prompt {prompt_id}: {e}")
+
+async def gather_or_cancel(*coros) -> list:
+    """Like ``asyncio.gather``, but once one fails the rest are cancelled and waited for.
+
+    Staging inside :meth:`InputImageCache.holding` relies on this: a stage
+    still running after the block exits would hold its upload forever.
+    Bytes kept by the stages (or fetches) that did finish are closed.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, StagedImage):
+                content = result.original
+            elif isinstance(result, tuple):  # (digest, content) from InputImageCache.fetch
+                content = result[1]
+            else:
+                content = None
+            if content is not None:
+                content.close()
+        raise
+
+async def delete_outputs(comfy: ComfyClient, images: list, delay: float):
+    """Delete output images after ``delay``.
+
+    An identical prompt queued right behind this one is answered from
+    ComfyUI's cache with the same files, so they must outlive the read.
+    """
+    await asyncio.sleep(delay)
+    for image in images:
+        await asyncio.to_thread(comfy.delete_output, image)
+
+def make_janitors(input_cache: InputImageCache, input_dir: str | None, output_dirs: list) -> list:
+    """Sweepers for whichever of ComfyUI's input and output folders are on this machine."""
+    janitors = []
+    if input_dir:
+        janitors.append(DirectoryJanitor(
+            input_dir, UPLOAD_NAME_PATTERN, JANITOR_MAX_AGE, COMFY_DIR_MAX_BYTES,
+            in_use=input_cache.uploaded_names, label="input",
+        ))
+    for output_dir in filter(None, output_dirs):
+        prefix = LIGHT_TRANSFER.output_prefix
+        janitors.append(DirectoryJanitor(
+            os.path.join(output_dir, os.path.dirname(prefix)),
+            re.escape(os.path.basename(prefix)) + r"_\d+_\.", JANITOR_MAX_AGE, COMFY_DIR_MAX_BYTES,
+            label="output",
+        ))
+    return janitors
+
+async def run_workflow(comfy: ComfyClient, events: ComfyEventStream, prompt_json: str, output_node: str, timeout: float) -> list:
+    """Queue a prompt, wait for it to finish and return its output image references.
+
+    If the wait ends any other way, the prompt is removed from ComfyUI so
+    it does not hold up the GPU for a result nobody will read.
+    """
+    # Choosing the id up front lets the shared websocket route events to us from the start
+    prompt_id = str(uuid.uuid4())
+    run = events.track(prompt_id)
+    try:
+        with span("submit"):
+            queued_id = await comfy.queue_prompt(prompt_json, events.client_id, prompt_id)
+        submitted_at = time.perf_counter()
+        if queued_id != prompt_id:
+            # Older ComfyUI versions assign their own ids
+            events.untrack(prompt_id)
+            prompt_id = queued_id
+            run = events.track(prompt_id)
+
+        # Wait for completion with timeout
         try:
-            response = requests.get(image_url, timeout=30, stream=True)
-            response.raise_for_status()
-            
-            # Check content length before downloading
-            content_length = response.headers.get('content-length')
-            if content_length and int(content_length) > max_size_mb * 1024 * 1024:
-                raise ValueError(f"Image too large. Max size: {max_size_mb}MB")
-            
-            # Download with size limit
-            content = BytesIO()
-            total_size = 0
-            max_bytes = max_size_mb * 1024 * 1024
-            
-            for chunk in response.iter_content(8192):
-                total_size += len(chunk)
-                if total_size > max_bytes:
-                    raise ValueError(f"Image exceeds {max_size_mb}MB limit")
-                content.write(chunk)
-            
-            content.seek(0)
-            
-            # Validate it's actually an image and convert to PNG
-            try:
-                pil = PILImage.open(content)
-                # Verify it's a valid image by loading it
-                pil.verify()
-                # Reopen for actual conversion (verify closes the file)
-                content.seek(0)
-                pil = PILImage.open(content)
-                
-                # Convert to RGB if necessary (handles RGBA, L, etc.)
-                if pil.mode not in ['RGB', 'L']:
-                    if pil.mode == 'RGBA':
-                        # Create white background for transparency
-                        background = PILImage.new('RGB', pil.size, (255, 255, 255))
-                        background.paste(pil, mask=pil.split()[3] if len(pil.split()) == 4 else None)
-                        pil = background
-                    else:
-                        pil = pil.convert('RGB')
-                
-                buf = BytesIO()
-                pil.save(buf, format="PNG")
-                return base64.b64encode(buf.getvalue()).decode()
-            except Exception as img_err:
-                raise ValueError(f"Invalid image format: {str(img_err)}")
-            
-        except requests.RequestException as e:
-            if attempt < max_retries - 1:
-                import time
-                time.sleep(0.5 * (attempt + 1))  # Exponential backoff
-                continue
-            raise ValueError(f"Failed to download image after {max_retries} attempts: {str(e)}")
-
-def upload_images(images):
-    for img in images:
-        blob = base64.b64decode(img["image"])
-        files = {"image": (img["name"], BytesIO(blob), "image/png")}
-        r = requests.post(f"http://{COMFY_HOST}/upload/image", files=files)
-        r.raise_for_status()
-
-def apply_fixed_values(workflow: dict, seed_value: int):
-    for node in workflow.values():
-        inputs = node.get("inputs", {})
-
-        if node.get("class_type") == "KSampler":
-            inputs["seed"] = seed_value
+            outputs = await asyncio.wait_for(run.done, timeout=timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Workflow execution timed out")
+        record_run_timings(run, submitted_at, LIGHT_TRANSFER.class_types)
+    except BaseException as e:
+        # wait_for cancels the future when it gives up, so only a set result or error means
+        # ComfyUI is done with the prompt. A rejected prompt was never queued; a cancelled
+        # /prompt call may have been
+        finished = run.done.done() and not run.done.cancelled()
+        if not finished and not isinstance(e, ComfyRejectedError):
+            reason = "timeout" if isinstance(e, TimeoutError) else "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+            # Runs detached: a cancelled request cannot await its own cleanup
+            in_background(cancel_prompt(comfy, prompt_id, reason))
+        raise
+    finally:
+        events.untrack(prompt_id)
+
+    images = list(outputs.get(output_node, []))
+    if not images:
+        # Cached outputs are not re-announced over the websocket
+        history = await comfy.get_history(prompt_id)
+        for node in history[prompt_id]["outputs"].values():
+            images.extend(node.get("images", []))
+    return images
+
+def make_warmup_image(size: int, color: tuple) -> bytes:
+    pil = PILImage.new("RGB", (size, size), color)
+    buf = BytesIO()
+    pil.save(buf, format="PNG")
+    return buf.getvalue()
+
+async def warm_up(comfy: ComfyClient, events: ComfyEventStream) -> float:
+    """Run the real workflow on tiny images so every model is loaded before traffic.
+
+    Returns how long a "standard" prompt took once the models were loaded,
+    the scheduler's first estimate before real requests have run.
+    """
+    main_img, ref_img, timed_main, timed_ref = await asyncio.gather(
+        comfy.upload_image("warmup_main.png", make_warmup_image(64, (120, 120, 120)), overwrite=True),
+        comfy.upload_image("warmup_ref.png", make_warmup_image(64, (200, 140, 80)), overwrite=True),
+        # Different images, so ComfyUI's cache cannot skip any node of the timed run
+        comfy.upload_image("warmup_timed_main.png", make_warmup_image(64, (90, 110, 130)), overwrite=True),
+        comfy.upload_image("warmup_timed_ref.png", make_warmup_image(64, (230, 180, 120)), overwrite=True),
+    )
+    # One step loads and exercises every model just the same
+    prompt_json = LIGHT_TRANSFER.render(main_image=main_img, reference_image=ref_img, seed=0, steps=1)
+    images = await run_workflow(comfy, events, prompt_json, LIGHT_TRANSFER.output_node, WARMUP_TIMEOUT)
+    # Then a full run to time: the workflow scales even tiny inputs to its own size
+    started = time.perf_counter()
+    prompt_json = LIGHT_TRANSFER.render(main_image=timed_main, reference_image=timed_ref, seed=0)
+    timed_images = await run_workflow(comfy, events, prompt_json, LIGHT_TRANSFER.output_node, WARMUP_TIMEOUT)
+    seconds = time.perf_counter() - started
+    if not images or not timed_images:
+        raise RuntimeError("Warm-up prompt produced no output")
+    in_background(delete_outputs(comfy, images + timed_images, OUTPUT_RETENTION))
+    return seconds
+
+def prepare_models(timer: PhaseTimer):
+    # Drop corrupt or truncated weights, download whatever is missing
+    # (parallel, resumable, atomically renamed) and verify the result
+    manifest = ModelManifest(MODEL_MANIFEST_PATH)
+    with timer.phase("models_verify"):
+        verify_models(MODEL_LIST, manifest)
+    with timer.phase("models_download"):
+        download_models(MODEL_LIST)
+    with timer.phase("models_verify_downloads"):
+        if verify_models(MODEL_LIST, manifest):
+            raise RuntimeError("Downloaded models failed verification")
+
+    # Symlink models
+    with timer.phase("models_link"):
+        for model in MODEL_LIST:
+            ensure_dir(model["target"])
+            if not os.path.exists(model["target"]):
+                os.symlink(model["path"], model["target"])
+
+def describe_error(error: Exception) -> str:
+    """Short client-facing description of a failed batch item."""
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    if isinstance(error, OverloadedError):
+        return f"Server busy, retry in {error.retry_after}s: {str(error)}"
+    if isinstance(error, TimeoutError):
+        return f"Request timed out: {str(error)}"
+    if isinstance(error, ValueError):
+        return f"Image validation failed: {str(error)}"
+    if isinstance(error, ComfyRejectedError):
+        return f"ComfyUI rejected workflow: {str(error)}"
+    if isinstance(error, ComfyCrashedError):
+        return f"ComfyUI crashed, retry in {error.retry_after}s: {str(error)}"
+    if isinstance(error, ComfyExecutionError):
+        return f"Workflow execution failed: {str(error)}"
+    traceback.print_exception(error)
+    return f"Internal server error: {str(error)}"
+
+def failure_kind(error: Exception) -> str:
+    """Metrics label for why a request or batch item failed."""
+    if isinstance(error, HTTPException) and error.__context__ is not None:
+        # Errors re-raised as HTTP errors are counted by their original cause
+        error = error.__context__
+    if isinstance(error, HTTPException):
+        return f"http_{error.status_code}"
+    if isinstance(error, OverloadedError):
+        return "overloaded"
+    if isinstance(error, TimeoutError):
+        return "timeout"
+    if isinstance(error, ValueError):
+        return "invalid_input"
+    if isinstance(error, ComfyRejectedError):
+        return "comfy_rejected"
+    if isinstance(error, ComfyCrashedError):
+        return "comfy_crashed"
+    if isinstance(error, ComfyExecutionError):
+        return "comfy_execution"
+    return "internal"
+
+@contextmanager
+def instrument(endpoint: str, response: Response):
+    """Count and time one request, exposing its stages as a ``Server-Timing`` header."""
+    timer = PhaseTimer()
+    metrics.REQUESTS.labels(endpoint=endpoint).inc()
+    try:
+        with metrics.IN_FLIGHT.labels(endpoint=endpoint).track_inprogress(), activate(timer):
+            yield timer
+    except Exception as e:
+        metrics.FAILURES.labels(endpoint=endpoint, kind=failure_kind(e)).inc()
+        raise
+    except asyncio.CancelledError:
+        metrics.FAILURES.labels(endpoint=endpoint, kind="cancelled").inc()
+        raise
+    finally:
+        timer.record("total", time.perf_counter() - timer.started)
+        response.headers["Server-Timing"] = timer.server_timing()
+        metrics.observe_stages(timer)
+
+@asynccontextmanager
+async def cancel_on_disconnect(request: Request):
+    """Cancel the current task if the client goes away before it finishes."""
+    task = asyncio.current_task()
+
+    async def watch():
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+        print("Client disconnected, cancelling request")
+        task.cancel()
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield
+    finally:
+        watcher.cancel()
+
+def overloaded(error: OverloadedError) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail=f"Server busy, retry later: {str(error)}",
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+def output_image_from_bytes(data: bytes, format: str = "png") -> Image:
+    """Upload encoded image bytes (SaveImage PNGs by default) as-is; only the header is parsed for its size."""
+    width, height = PILImage.open(BytesIO(data)).size
+    return Image.from_bytes(data, format=format, size=ImageSize(width=width, height=height))
+
+def render_preview(main, reference) -> bytes:
+    """Reinhard color transfer of two small RGB arrays, encoded as JPEG."""
+    return encode_preview(reinhard_transfer(main, reference))
 
 # -------------------------------------------------
 # Input Model (ONLY image inputs in UI)
@@ -185,6 +439,28 @@ class LightTransferInput(BaseModel):
         description="URL of the reference image whose lighting and color tone will be applied to the main image. (REQUIRED)",
         examples=["https://images.pexels.com/photos/29422068/pexels-photo-29422068.jpeg?cs=srgb&dl=pexels-omergulen-29422068.jpg&fm=jpg"]
     )
+    seed: int | None = Field(
+        None,
+        ge=0,
+        le=MAX_SEED,
+        title="Seed",
+        description="Sampling seed. Repeating a request with the same images and seed returns the stored result. Random if omitted.",
+    )
+    quality: Literal["draft", "standard", "high"] = Field(
+        "standard",
+        title="Quality",
+        description="Speed/quality trade-off. \"draft\" samples at lower resolution for fast previews; \"high\" samples at higher resolution. Billed in proportion to GPU time.",
+    )
+    full_resolution: bool = Field(
+        False,
+        title="Full Resolution",
+        description="Return the result at the main image's original size instead of about one megapixel. The relit colors and lighting are carried over to the original pixels on the CPU, at no extra GPU cost.",
+    )
+    priority: Literal["interactive", "bulk"] = Field(
+        "interactive",
+        title="Priority",
+        description="Scheduling lane. \"interactive\" requests are run ahead of \"bulk\" ones; bulk requests are still run once they have waited a while.",
+    )
 
 # -------------------------------------------------
 # Output Model
@@ -194,6 +470,7 @@ class LightTransferOutput(BaseModel):
         ...,
         description="The generated image with applied lighting and color transfer."
     )
+    seed: int = Field(..., description="The seed used; pass it again to get the same result.")
 
     class Config:
         json_schema_extra = {
@@ -203,10 +480,82 @@ class LightTransferOutput(BaseModel):
                     "content_type": "image/png",
                     "file_name": "example.png",
                     "file_size": 1024000
-                }
+                },
+                "seed": 42
             }
         }
 
+class LightTransferPreviewOutput(BaseModel):
+    image: Image = Field(
+        ...,
+        description="A small, approximate preview: the reference's color and tone statistics applied to the main image."
+    )
+
+# -------------------------------------------------
+# Batch Models
+# -------------------------------------------------
+class LightTransferBatchInput(BaseModel):
+    reference_image_url: str = Field(
+        ...,
+        title="Reference Image URL",
+        description="URL of the reference image whose lighting and color tone will be applied to every main image. (REQUIRED)",
+        examples=["https://images.pexels.com/photos/29422068/pexels-photo-29422068.jpeg?cs=srgb&dl=pexels-omergulen-29422068.jpg&fm=jpg"]
+    )
+    main_image_urls: list[str] = Field(
+        ...,
+        min_length=1,
+        max_length=MAX_BATCH_SIZE,
+        title="Main Image URLs",
+        description=f"URLs of the main images to relight/recolor with the same reference (at most {MAX_BATCH_SIZE}). (REQUIRED)",
+        examples=[["https://img.freepik.com/free-photo/young-woman-new-york-city-daytime_23-2149488480.jpg?semt=ais_hybrid&w=740&q=80"]]
+    )
+    seed: int | None = Field(
+        None,
+        ge=0,
+        le=MAX_SEED,
+        title="Seed",
+        description="Sampling seed used for every image. Random per image if omitted.",
+    )
+    quality: Literal["draft", "standard", "high"] = Field(
+        "standard",
+        title="Quality",
+        description="Speed/quality trade-off. \"draft\" samples at lower resolution for fast previews; \"high\" samples at higher resolution. Applies to every image.",
+    )
+    full_resolution: bool = Field(
+        False,
+        title="Full Resolution",
+        description="Return every result at its main image's original size instead of about one megapixel. The relit colors and lighting are carried over to the original pixels on the CPU, at no extra GPU cost.",
+    )
+    priority: Literal["interactive", "bulk"] = Field(
+        "bulk",
+        title="Priority",
+        description="Scheduling lane for every image; see the single-image endpoint. Batches default to \"bulk\" so they do not hold up interactive requests.",
+    )
+
+    def items(self) -> list[LightTransferInput]:
+        return [
+            LightTransferInput(
+                main_image_url=url,
+                reference_image_url=self.reference_image_url,
+                seed=self.seed,
+                quality=self.quality,
+                full_resolution=self.full_resolution,
+                priority=self.priority,
+            )
+            for url in self.main_image_urls
+        ]
+
+class LightTransferBatchResult(BaseModel):
+    main_image_url: str = Field(..., description="The main image this result belongs to.")
+    output: LightTransferOutput | None = Field(None, description="The generated output, if this item succeeded.")
+    error: str | None = Field(None, description="Why this item failed, if it did.")
+
+class LightTransferBatchOutput(BaseModel):
+    results: list[LightTransferBatchResult] = Field(
+        ...,
+        description="One result per main image, in request order."
+    )
+
 # -------------------------------------------------
 # App
 # -------------------------------------------------
@@ -216,150 +565,540 @@ class LightTransfer(fal.App, keep_alive=100, min_concurrency=0, max_concurrency=
     image = custom_image
     machine_type = "GPU-H100"
     request_timeout = 300
-    requirements = ["websockets", "websocket-client"]
+    requirements = ["websockets", "httpx", "prometheus-client", "numpy==2.4.6"]
     private_logs = True
 
-    def setup(self):
-        # Download models
-        for model in MODEL_LIST:
-            download_if_missing(model["url"], model["path"])
+    async def setup(self):
+        timer = PhaseTimer()
 
-        # Symlink models
-        for model in MODEL_LIST:
-            ensure_dir(model["target"])
-            if not os.path.exists(model["target"]):
-                os.symlink(model["path"], model["target"])
+        # Start ComfyUI (NO --log-stdout) first so it boots while the models
+        # are verified, downloaded and linked; weights load lazily per prompt
+        instances = [comfy_instance(index) for index in range(COMFY_INSTANCES)]
+        self.comfy_processes = [ComfyProcess(command, host) for command, host, _ in instances]
+        for process in self.comfy_processes:
+            process.start()
+
+        with timer.phase("comfy_and_models"):
+            *comfy_ready, _ = await asyncio.gather(
+                *(asyncio.to_thread(process.wait_ready, COMFY_START_TIMEOUT) for process in self.comfy_processes),
+                asyncio.to_thread(prepare_models, timer),
+            )
+        for process, ready in zip(self.comfy_processes, comfy_ready):
+            if not ready:
+                raise RuntimeError(f"ComfyUI at {process.host} failed to start; last output:\n{process.log_tail()}")
+        timer.record("comfy_boot", max(process.boot_seconds for process in self.comfy_processes))
+
+        await self.connect([(host, output_dir) for _, host, output_dir in instances], COMFY_INPUT_DIR)
+
+        # Load UNet, CLIP, VAE and both LoRAs before the first real request
+        with timer.phase("warmup"):
+            await asyncio.gather(*(self.warm(backend) for backend in self.pool.backends))
 
-        # Start ComfyUI (NO --log-stdout)
-        import subprocess
-        self.comfy = subprocess.Popen(
-            [
-                "python", "-u", "/comfyui/main.py",
-                "--disable-auto-launch",
-                "--disable-metadata",
-                "--listen", "--port", "8188"
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
+        # Fail in-flight prompts the moment an instance dies, then restart and re-warm it
+        self.supervisor_tasks = [
+            asyncio.create_task(ComfySupervisor(
+                process, backend.events, backend.scheduler, functools.partial(self.rewarm, backend),
+                COMFY_START_TIMEOUT,
+            ).run())
+            for process, backend in zip(self.comfy_processes, self.pool.backends)
+        ]
+
+        print(json.dumps(timer.report("startup_report")))
+
+    async def connect(
+        self,
+        comfy_backends: list[tuple[str, str | None]],
+        input_dir: str | None = None,
+        result_cache_dir: str = RESULT_CACHE_DIR,
+    ):
+        """Create the clients and caches shared by every request and open the ComfyUI event streams.
+
+        ``comfy_backends`` lists the host and, if on this machine, the output
+        folder of each ComfyUI instance.
+        """
+        # Pooled keep-alive clients shared by every request on this worker
+        self.remote_http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=REMOTE_MAX_CONNECTIONS,
+                max_keepalive_connections=REMOTE_MAX_CONNECTIONS,
+            ),
+            timeout=30,
+            follow_redirects=True,
         )
+        # Bounds the memory of concurrent decodes across all requests on this worker
+        self.input_cache = InputImageCache(
+            INPUT_CACHE_DIR, INPUT_CACHE_MAX_BYTES, MemoryBudget(DECODE_MEMORY_BUDGET), MAX_INPUT_PIXELS
+        )
+        # On the persistent volume, so retries hit it whichever worker serves them
+        self.result_cache = await asyncio.to_thread(ResultCache, result_cache_dir, RESULT_CACHE_MAX_BYTES)
+        # A caller's own deadline or admission failing does not fail the identical requests waiting on it
+        self.flights = SingleFlight(personal=(TimeoutError, OverloadedError))
+        backends = []
+        for host, output_dir in comfy_backends:
+            client = ComfyClient(
+                host, max_connections=COMFY_MAX_CONNECTIONS, output_dir=output_dir, input_dir=input_dir
+            )
+            # One multiplexed websocket per instance routes progress events to every request
+            events = ComfyEventStream(client)
+            await events.start()
+            # Prepares inputs concurrently but keeps only the next prompt queued behind the running one
+            scheduler = PromptScheduler(
+                client, PREP_CONCURRENCY, GPU_QUEUE_DEPTH, INITIAL_PROMPT_SECONDS, lane_delays=PRIORITY_LANES
+            )
+            backends.append(ComfyBackend(client, events, scheduler))
+        # Each request runs on the least loaded instance
+        self.pool = ComfyPool(backends)
+        # Requests delete their own files; the janitors sweep up whatever they leave behind
+        self.janitor_tasks = [
+            asyncio.create_task(janitor.run(JANITOR_INTERVAL))
+            for janitor in make_janitors(self.input_cache, input_dir, [output_dir for _, output_dir in comfy_backends])
+        ]
 
-        if not check_server(f"http://{COMFY_HOST}/system_stats"):
-            raise RuntimeError("ComfyUI failed to start")
+    async def warm(self, backend: ComfyBackend):
+        """Warm up a ComfyUI instance, seeding its scheduler's prompt time estimate."""
+        backend.scheduler.observe(await warm_up(backend.client, backend.events))
 
-    @fal.endpoint("/")
-    async def handler(self, input: LightTransferInput, response: Response) -> LightTransferOutput:
+    async def rewarm(self, backend: ComfyBackend):
+        """Prepare a restarted ComfyUI instance for traffic again."""
+        # Files written when it died may be missing or truncated, so upload everything afresh
+        self.input_cache.forget_uploads(backend.client)
+        await self.warm(backend)
+
+    async def stage_input(
+        self,
+        backend: ComfyBackend,
+        image_url: str,
+        role: str,
+        holds: list,
+        quality: str = "standard",
+        keep_original: bool = False,
+        fetched: tuple[str, BinaryIO | None] | None = None,
+    ) -> StagedImage:
+        """Upload the image for a workflow image role, pre-scaled the way the workflow scales it at ``quality``.
+
+        The upload is held in ``holds`` from :meth:`InputImageCache.holding`.
+        With ``keep_original`` the downloaded bytes come back on the staged
+        image for :meth:`transfer` to upsample to, and the caller closes them.
+        ``fetched`` is the image as :meth:`fetch_input` already returned it.
+        """
+        scale = LIGHT_TRANSFER.input_scale(role, **QUALITY_TIERS[quality])
+        return await self.input_cache.stage(
+            self.remote_http, backend.client, image_url,
+            label=role.removesuffix("_image"), scale=scale, holds=holds, keep_original=keep_original,
+            fetched=fetched,
+        )
+
+    async def fetch_input(self, image_url: str, role: str) -> tuple[str, BinaryIO | None]:
+        """Download an image (or revalidate the cached copy); returns its digest and bytes, if not cached."""
+        with span(f"{role.removesuffix('_image')}_download"):
+            return await self.input_cache.fetch(self.remote_http, image_url)
+
+    async def cached_output(
+        self,
+        main: tuple[str, BinaryIO | None],
+        reference_digest: str,
+        seed: int,
+        quality: str = "standard",
+        full_resolution: bool = False,
+    ) -> LightTransferOutput | None:
+        """The stored result of a seeded request, if there is one, published without touching ComfyUI.
+
+        ``main`` is the main image as :meth:`fetch_input` returned it; the
+        caller still closes its bytes.
+        """
+        main_digest, content = main
+        with span("result_cache"):
+            data = await asyncio.to_thread(
+                self.result_cache.get, output_key(main_digest, reference_digest, quality, seed)
+            )
+        metrics.RESULT_CACHE.labels(outcome="hit" if data is not None else "miss").inc()
+        if data is None or not full_resolution:
+            return None if data is None else await self.publish(data, seed)
+        original = content if content is not None else await self.input_cache.load(main_digest)
         try:
-            # Validate workflow structure
-            job = copy.deepcopy(WORKFLOW_JSON)
-            if "input" not in job or "workflow" not in job["input"]:
-                raise ValueError("Invalid workflow structure")
-            
-            workflow = job["input"]["workflow"]
+            original.seek(0)
+            await asyncio.to_thread(check_full_size, original, self.input_cache.max_pixels)
+            return await self.finish(original, data, seed, quality, full_resolution)
+        finally:
+            if content is None:
+                original.close()
 
-            main_img = f"main_{uuid.uuid4().hex}.png"
-            ref_img = f"ref_{uuid.uuid4().hex}.png"
+    async def transfer(
+        self,
+        backend: ComfyBackend,
+        main: StagedImage,
+        ref: StagedImage,
+        ticket: Ticket,
+        deadline: float,
+        seed: int | None = None,
+        quality: str = "standard",
+        full_resolution: bool = False,
+    ) -> LightTransferOutput:
+        """Run the workflow on ``backend`` for two images uploaded to it and publish the result.
 
-            # Download and validate images
-            try:
-                main_b64 = image_url_to_base64(input.main_image_url)
-                ref_b64 = image_url_to_base64(input.reference_image_url)
-            except ValueError as img_err:
-                raise HTTPException(status_code=400, detail=f"Image validation failed: {str(img_err)}")
-            except Exception as img_err:
-                raise HTTPException(status_code=500, detail=f"Failed to download images: {str(img_err)}")
-
-            upload_images([
-                {"name": main_img, "image": main_b64},
-                {"name": ref_img, "image": ref_b64}
-            ])
-
-            # Validate and update workflow nodes
-            if "31" not in workflow or "inputs" not in workflow["31"]:
-                raise ValueError("Invalid workflow: missing node 31")
-            if "7" not in workflow or "inputs" not in workflow["7"]:
-                raise ValueError("Invalid workflow: missing node 7")
-            
-            workflow["31"]["inputs"]["image"] = main_img
-            workflow["7"]["inputs"]["image"] = ref_img
+        Concurrent identical calls share one run (see :class:`SingleFlight`);
+        the ones waiting give up their ticket's place in the backlog. With a
+        caller-chosen ``seed`` the output is deterministic, so it is also
+        saved to the result cache; callers look it up with
+        :meth:`cached_output` before admission. Without one, calls that
+        share a run share its random seed too. ``deadline`` is on the event
+        loop clock. With ``full_resolution`` the result is upsampled to
+        ``main.original``, which must have been kept when staging; the cache
+        holds the workflow output either way.
+        """
+        cacheable = seed is not None
+        # Seedless calls are keyed without a seed, so identical ones in flight share the seed drawn here
+        key = output_key(main.digest, ref.digest, quality, seed)
+        if seed is None:
+            seed = random.randint(0, MAX_SEED)
+        values = {**QUALITY_TIERS[quality], "seed": seed}
 
-            seed_value = random.randint(0, 2**63 - 1)
-            apply_fixed_values(workflow, seed_value)
+        async def produce() -> LightTransferOutput:
+            if cacheable:
+                # Stored by an identical request that finished while this one was staged
+                with span("result_cache"):
+                    data = await asyncio.to_thread(self.result_cache.get, key)
+                if data is not None:
+                    return await self.finish(main.original, data, seed, quality, full_resolution)
 
-            # Run ComfyUI
-            client_id = str(uuid.uuid4())
-            ws = websocket.WebSocket()
-            ws.settimeout(240)  # 4 minute websocket timeout
-            
-            try:
-                ws.connect(f"ws://{COMFY_HOST}/ws?clientId={client_id}")
+            prompt_json = LIGHT_TRANSFER.render(main_image=main.name, reference_image=ref.name, **values)
 
-                resp = requests.post(
-                    f"http://{COMFY_HOST}/prompt",
-                    json={"prompt": workflow, "client_id": client_id},
-                    timeout=30
+            # Run ComfyUI once one of the GPU queue slots is free; counted as waiting again
+            # if this call took over from one it had been waiting on
+            backend.scheduler.reclaim(ticket)
+            loop = asyncio.get_running_loop()
+            async with backend.scheduler.gpu_slot(ticket, deadline, QUALITY_COSTS[quality]):
+                images = await run_workflow(
+                    backend.client, backend.events, prompt_json, LIGHT_TRANSFER.output_node,
+                    timeout=max(deadline - loop.time(), 0),
                 )
-                
-                # Log detailed error if request fails
-                if resp.status_code != 200:
-                    error_detail = resp.text
-                    print(f"ComfyUI Error Response: {error_detail}")
-                    raise HTTPException(status_code=500, detail=f"ComfyUI rejected workflow: {error_detail}")
-                
-                prompt_id = resp.json()["prompt_id"]
-
-                # Wait for completion with timeout
-                import time
-                start_time = time.time()
-                while time.time() - start_time < 240:  # 4 minute max
-                    out = ws.recv()
-                    if not out.strip().startswith('{'):
-                        continue
-                    msg = json.loads(out)
-                    if msg.get("type") == "executing" and msg["data"]["node"] is None:
-                        break
-                else:
-                    raise TimeoutError("Workflow execution timed out")
-
-                history = requests.get(
-                    f"http://{COMFY_HOST}/history/{prompt_id}"
-                ).json()
-
-                # Get first image
-                output_image = None
-                for node in history[prompt_id]["outputs"].values():
-                    for img in node.get("images", []):
-                        params = (
-                            f"filename={img['filename']}"
-                            f"&subfolder={img.get('subfolder','')}"
-                            f"&type={img['type']}"
+            if not images:
+                raise HTTPException(status_code=500, detail="No output image generated")
+
+            # Get first image
+            with span("output_read"):
+                data = await backend.client.read_output(images[0])
+            in_background(delete_outputs(backend.client, images, OUTPUT_RETENTION))
+            if not cacheable:
+                return await self.finish(main.original, data, seed, quality, full_resolution)
+            output, _ = await asyncio.gather(
+                self.finish(main.original, data, seed, quality, full_resolution),
+                asyncio.to_thread(self.result_cache.put, key, data),
+            )
+            return output
+
+        # Identical requests in flight (retries, duplicate submissions) wait for one prompt
+        return await self.flights.run(
+            f"{key}-{'full' if full_resolution else 'workflow'}", produce,
+            on_wait=lambda: backend.scheduler.release(ticket),
+        )
+
+    async def finish(
+        self, original: BinaryIO | None, data: bytes, seed: int, quality: str, full_resolution: bool
+    ) -> LightTransferOutput:
+        """Publish workflow output, first upsampled to the size of the ``original`` main image if asked to."""
+        if full_resolution:
+            data = await self.restore_resolution(original, data, quality)
+        return await self.publish(data, seed)
+
+    async def restore_resolution(self, original: BinaryIO, data: bytes, quality: str) -> bytes:
+        """Carry the workflow output's lighting over to the full-size main image, on the CPU."""
+        # The output covers the main image as the workflow scaled and cropped it at this quality
+        scale = LIGHT_TRANSFER.input_scale("main_image", **QUALITY_TIERS[quality])
+        with span("upsample"):
+            needed = await asyncio.to_thread(upsample_memory, original, data)
+            async with self.input_cache.memory.reserve(needed):
+                return await asyncio.to_thread(guided_upsample, original, data, scale)
+
+    async def publish(self, data: bytes, seed: int) -> LightTransferOutput:
+        with span("output_upload"):
+            output_image = await asyncio.to_thread(output_image_from_bytes, data)
+        metrics.BYTES_OUT.labels(destination="result").inc(len(data))
+        return LightTransferOutput(image=output_image, seed=seed)
+
+    @fal.endpoint("/")
+    async def handler(self, input: LightTransferInput, request: Request, response: Response) -> LightTransferOutput:
+        # A client that went away cancels its request, which withdraws its prompt from ComfyUI
+        async with cancel_on_disconnect(request):
+            return await self.handle_single(input, response)
+
+    async def handle_single(self, input: LightTransferInput, response: Response) -> LightTransferOutput:
+        with instrument("/", response):
+            deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT
+            # Images downloaded for the result cache lookup, until staging takes them over
+            fetched = {}
+            try:
+                cost = QUALITY_COSTS[input.quality]
+                if input.seed is not None:
+                    # A stored result is served before admission, which may turn the request away, and
+                    # without touching ComfyUI; only the image digests are needed to look it up
+                    try:
+                        fetched["main_image"], fetched["reference_image"] = await gather_or_cancel(
+                            self.fetch_input(input.main_image_url, "main_image"),
+                            self.fetch_input(input.reference_image_url, "reference_image"),
                         )
-                        r = requests.get(f"http://{COMFY_HOST}/view?{params}")
-                        pil_image = PILImage.open(BytesIO(r.content))
-                        output_image = Image.from_pil(pil_image, format="png")
-                        break
-                    if output_image:
-                        break
-
-                if not output_image:
-                    raise HTTPException(status_code=500, detail="No output image generated")
-                
+                    except ValueError as img_err:
+                        raise HTTPException(status_code=400, detail=f"Image validation failed: {str(img_err)}")
+                    output = await self.cached_output(
+                        fetched["main_image"], fetched["reference_image"][0], input.seed, input.quality,
+                        input.full_resolution,
+                    )
+                    if output is not None:
+                        response.headers["x-fal-billable-units"] = f"{cost:g}"
+                        return output
+
+                # Turn the request away before staging anything if it cannot finish in time
+                async with self.pool.admit(1, REQUEST_TIMEOUT, cost=cost, lane=input.priority) as (backend, ticket):
+                    # Inputs of a request that times out or is cancelled are deleted again
+                    with self.input_cache.holding() as holds:
+                        # Download, validate and upload both images concurrently; repeated
+                        # images resolve to their already uploaded content-addressed name
+                        try:
+                            async with backend.scheduler.prep:
+                                main_img, ref_img = await gather_or_cancel(
+                                    self.stage_input(
+                                        backend, input.main_image_url, "main_image", holds, input.quality,
+                                        keep_original=input.full_resolution, fetched=fetched.pop("main_image", None),
+                                    ),
+                                    self.stage_input(
+                                        backend, input.reference_image_url, "reference_image", holds, input.quality,
+                                        fetched=fetched.pop("reference_image", None),
+                                    ),
+                                )
+                        except ValueError as img_err:
+                            raise HTTPException(status_code=400, detail=f"Image validation failed: {str(img_err)}")
+                        except Exception as img_err:
+                            raise HTTPException(status_code=500, detail=f"Failed to prepare images: {str(img_err)}")
+
+                        try:
+                            output = await self.transfer(
+                                backend, main_img, ref_img, ticket, deadline, input.seed, input.quality,
+                                input.full_resolution,
+                            )
+                        except ComfyRejectedError as e:
+                            # Log detailed error if request fails
+                            print(f"ComfyUI Error Response: {e}")
+                            raise HTTPException(status_code=500, detail=f"ComfyUI rejected workflow: {e}")
+                        except ComfyCrashedError as e:
+                            raise HTTPException(
+                                status_code=503,
+                                detail=f"ComfyUI crashed, retry later: {e}",
+                                headers={"Retry-After": str(e.retry_after)},
+                            )
+                        except ComfyExecutionError as e:
+                            raise HTTPException(status_code=500, detail=f"Workflow execution failed: {e}")
+                        finally:
+                            if main_img.original is not None:
+                                main_img.original.close()
+
                 # Add billing headers
-                response.headers["x-fal-billable-units"] = "1"
-                
-                return LightTransferOutput(image=output_image)
+                response.headers["x-fal-billable-units"] = f"{cost:g}"
+            
+                return output
+
+            except HTTPException:
+                raise
+            except OverloadedError as e:
+                raise overloaded(e)
+            except TimeoutError as e:
+                raise HTTPException(status_code=504, detail=f"Request timed out: {str(e)}")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            except Exception as e:
+                traceback.print_exc()
+                raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
             finally:
-                # Cleanup websocket
+                # Left over if the request never got to staging
+                for _, content in fetched.values():
+                    if content is not None:
+                        content.close()
+
+    @fal.endpoint("/preview")
+    async def preview_handler(self, input: LightTransferInput, response: Response) -> LightTransferPreviewOutput:
+        """Instant CPU approximation of ``/`` for interactive feedback.
+
+        Downloads and validates the images the same way, then matches the
+        main image's CIELAB mean and spread to the reference's on a small
+        copy. Never touches ComfyUI or the GPU queue; ``seed``, ``quality``
+        and ``full_resolution`` are ignored.
+        """
+        with instrument("/preview", response):
+            try:
+                main, reference = await asyncio.gather(
+                    self.load_preview(input.main_image_url, "main"),
+                    self.load_preview(input.reference_image_url, "reference"),
+                )
+                with span("color_transfer"):
+                    data = await asyncio.to_thread(render_preview, main, reference)
+                with span("output_upload"):
+                    output_image = await asyncio.to_thread(output_image_from_bytes, data, "jpeg")
+                metrics.BYTES_OUT.labels(destination="result").inc(len(data))
+                response.headers["x-fal-billable-units"] = f"{PREVIEW_BILLABLE_UNITS:g}"
+                return LightTransferPreviewOutput(image=output_image)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Image validation failed: {str(e)}")
+            except Exception as e:
+                traceback.print_exc()
+                raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    async def load_preview(self, image_url: str, role: str):
+        """Download an image through the input cache and decode a copy of at most ``PREVIEW_MEGAPIXELS``."""
+        content = await self.input_cache.open(self.remote_http, image_url, label=role)
+        try:
+            with span(f"{role}_prepare"):
+                max_pixels = self.input_cache.max_pixels
+                needed = await asyncio.to_thread(decode_memory, content, max_pixels, PREVIEW_MEGAPIXELS)
+                async with self.input_cache.memory.reserve(needed):
+                    return await asyncio.to_thread(load_small, content, max_pixels, PREVIEW_MEGAPIXELS)
+        finally:
+            content.close()
+
+    @fal.endpoint("/batch")
+    async def batch_handler(
+        self, input: LightTransferBatchInput, request: Request, response: Response
+    ) -> LightTransferBatchOutput:
+        """Relight many main images with one reference in a single call.
+
+        Each image is admitted on the least loaded ComfyUI instance, which the
+        reference is staged on once. Main images are ingested concurrently
+        and each prompt is queued as soon as its image is uploaded, so ingest
+        overlaps with GPU work and ComfyUI always has the next prompt waiting.
+        The batch is admitted if its first prompt can finish in time; the
+        other items then wait for the GPU until the batch deadline, and those
+        that run out of time are returned as retryable errors.
+        """
+        async with cancel_on_disconnect(request):
+            return await self.handle_batch(input, response)
+
+    async def handle_batch(self, input: LightTransferBatchInput, response: Response) -> LightTransferBatchOutput:
+        with instrument("/batch", response):
+            items = input.items()
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + BATCH_TIMEOUT
+            cost = QUALITY_COSTS[input.quality]
+
+            with self.input_cache.holding() as batch_holds:
+                reference_stages = {}
+
+                async def stage_reference(backend: ComfyBackend) -> StagedImage:
+                    # Staged once on each backend the batch runs on, shared by its items
+                    if backend not in reference_stages:
+                        reference_stages[backend] = asyncio.ensure_future(
+                            self.stage_input(
+                                backend, input.reference_image_url, "reference_image", batch_holds, input.quality
+                            )
+                        )
+                    return await asyncio.shield(reference_stages[backend])
+
+                reference_fetch = None
+
+                async def reference_digest() -> str:
+                    # For result cache lookups; each backend's stage downloads the reference for itself
+                    nonlocal reference_fetch
+                    if reference_fetch is None:
+                        reference_fetch = asyncio.ensure_future(
+                            self.input_cache.digest(self.remote_http, input.reference_image_url)
+                        )
+                    return await asyncio.shield(reference_fetch)
+
+                first_admission = None  # settled once the batch's first prompt is admitted or refused
+
+                @asynccontextmanager
+                async def admit_item(item: LightTransferInput):
+                    # Admitted one by one, so the items spread over the least loaded backends
+                    nonlocal first_admission
+                    if first_admission is None:
+                        # Like a batch admitted as a whole: only its first prompt must fit in time
+                        first_admission = loop.create_future()
+                        try:
+                            admission = self.pool.admit(1, deadline - loop.time(), cost=cost, lane=item.priority)
+                            async with admission as admitted:
+                                first_admission.set_result(None)
+                                yield admitted
+                        except BaseException as e:
+                            if not first_admission.done():
+                                first_admission.set_exception(e)
+                                first_admission.exception()  # the items that share it raise it too
+                            raise
+                        return
+                    await asyncio.shield(first_admission)
+                    # The rest wait for a GPU slot until the deadline, not turned away on estimates
+                    async with self.pool.admit(1, math.inf, cost=cost, lane=item.priority) as admitted:
+                        yield admitted
+
+                rejections = []
+
+                async def run_item(item: LightTransferInput) -> LightTransferBatchResult:
+                    # Items run concurrently, so each gets its own timer for the stage histograms
+                    item_timer = PhaseTimer()
+                    main_fetched = None
+                    try:
+                        if item.seed is not None:
+                            # Served from the result cache before admission, like a single request
+                            with activate(item_timer):
+                                main_fetched = await self.fetch_input(item.main_image_url, "main_image")
+                                output = await self.cached_output(
+                                    main_fetched, await reference_digest(), item.seed, item.quality,
+                                    item.full_resolution,
+                                )
+                            if output is not None:
+                                return LightTransferBatchResult(main_image_url=item.main_image_url, output=output)
+                        with activate(item_timer), self.input_cache.holding() as holds:
+                            async with admit_item(item) as (backend, ticket):
+                                async with backend.scheduler.prep:
+                                    ref_img = await stage_reference(backend)
+                                    fetched, main_fetched = main_fetched, None
+                                    main_img = await self.stage_input(
+                                        backend, item.main_image_url, "main_image", holds, item.quality,
+                                        keep_original=item.full_resolution, fetched=fetched,
+                                    )
+                                try:
+                                    output = await self.transfer(
+                                        backend, main_img, ref_img, ticket, deadline, item.seed, item.quality,
+                                        item.full_resolution,
+                                    )
+                                finally:
+                                    if main_img.original is not None:
+                                        main_img.original.close()
+                        return LightTransferBatchResult(main_image_url=item.main_image_url, output=output)
+                    except Exception as e:
+                        if isinstance(e, OverloadedError):
+                            rejections.append(e)
+                        metrics.FAILURES.labels(endpoint="/batch_item", kind=failure_kind(e)).inc()
+                        return LightTransferBatchResult(main_image_url=item.main_image_url, error=describe_error(e))
+                    finally:
+                        if main_fetched is not None and main_fetched[1] is not None:
+                            main_fetched[1].close()
+                        metrics.observe_stages(item_timer)
+
                 try:
-                    ws.close()
-                except Exception as ws_err:
-                    print(f"Warning: Failed to close websocket: {ws_err}")
-
-        except HTTPException:
-            raise
-        except TimeoutError as e:
-            raise HTTPException(status_code=504, detail=f"Request timed out: {str(e)}")
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail=str(e))
-        except Exception as e:
-            traceback.print_exc()
-            raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+                    results = await asyncio.gather(*(run_item(item) for item in items))
+                finally:
+                    # Only still running if the batch was cancelled; finished before holding() exits
+                    reference_tasks = [*reference_stages.values(), *filter(None, [reference_fetch])]
+                    for task in reference_tasks:
+                        task.cancel()
+                    await asyncio.gather(*reference_tasks, return_exceptions=True)
+
+                # A bad reference fails every item, so it fails the batch
+                for stage in reference_tasks:
+                    ref_err = stage.exception()
+                    if isinstance(ref_err, ValueError):
+                        raise HTTPException(status_code=400, detail=f"Reference image validation failed: {str(ref_err)}")
+                    if ref_err is not None:
+                        traceback.print_exception(ref_err)
+                        raise HTTPException(status_code=500, detail=f"Failed to prepare reference image: {str(ref_err)}")
+                if len(rejections) == len(items):
+                    raise overloaded(rejections[0])
+
+            # Bill only for the images that were produced
+            produced = sum(result.output is not None for result in results)
+            response.headers["x-fal-billable-units"] = f"{produced * cost:g}"
+            return LightTransferBatchOutput(results=results)
+
+    @fal.endpoint("/metrics")
+    async def metrics_handler(self) -> Response:
+        """Prometheus metrics of this worker."""
+        metrics.QUEUE_DEPTH.set(self.pool.queue_remaining)
+        content, content_type = metrics.render()
+        return Response(content=content, media_type=content_type)
@@ -0,0 +1,270 @@
+import asyncio
+import os
+import shutil
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import BinaryIO, NamedTuple
+
+import httpx
+
+import metrics
+from comfy_client import ComfyClient
+from image_io import check_full_size, decode_memory, fetch_image, prepare_image
+from memory_budget import MemoryBudget
+from timing import span
+
+
+class StagedImage(NamedTuple):
+    name: str  # file name in ComfyUI's input folder
+    digest: str  # sha256 of the downloaded bytes
+    original: BinaryIO | None = None  # the downloaded bytes, if kept for the caller to close
+
+
+class CachedUrl(NamedTuple):
+    digest: str
+    etag: str | None
+    last_modified: str | None
+
+
+class InputImageCache:
+    """Content-addressed cache for input images shared across requests.
+
+    Remote downloads are remembered per URL together with their ETag /
+    Last-Modified validators and kept as blobs named by sha256 on local disk,
+    evicted least-recently-used once ``max_bytes`` is exceeded. Uploads to
+    ComfyUI are keyed by the same digest, so an image that was already
+    uploaded is referenced by its stable file name instead of being sent
+    again, which also lets ComfyUI reuse cached outputs of the nodes that
+    load and encode it.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int,
+        memory: MemoryBudget,
+        max_pixels: int,
+        max_uploads: int = 1024,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory = memory
+        self.max_pixels = max_pixels
+        self.max_uploads = max_uploads
+        self._urls: dict[str, CachedUrl] = {}
+        self._blobs: OrderedDict[str, int] = OrderedDict()
+        # Keyed by backend and upload key; backends may share one input folder
+        self._uploads: OrderedDict[tuple[ComfyClient, str], str] = OrderedDict()
+        self._holders: Counter[tuple[ComfyClient, str]] = Counter()
+        self._total_bytes = 0
+
+        # The URL index lives in memory, so blobs left by a previous process are unreachable
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest)
+
+    def _write_blob(self, digest: str, content: BinaryIO):
+        path = self._blob_path(digest)
+        # Concurrent requests may write the same digest at once
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            shutil.copyfileobj(content, f)
+        content.seek(0)
+        os.replace(tmp, path)
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and self._blobs:
+            digest, size = self._blobs.popitem(last=False)
+            self._total_bytes -= size
+            self._urls = {url: entry for url, entry in self._urls.items() if entry.digest != digest}
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    async def fetch(self, client: httpx.AsyncClient, image_url: str) -> tuple[str, BinaryIO | None]:
+        """Return the content digest of an image URL and, unless unchanged, its bytes.
+
+        ``None`` is returned instead of the bytes when the server confirmed
+        the cached copy is still current; use :meth:`load` if they are needed.
+        The caller closes the returned file.
+        """
+        cached = self._urls.get(image_url)
+        if cached and cached.digest not in self._blobs:
+            cached = None
+
+        fetched = await fetch_image(
+            client,
+            image_url,
+            etag=cached.etag if cached else None,
+            last_modified=cached.last_modified if cached else None,
+        )
+        if fetched.content is None:
+            if cached.digest in self._blobs:
+                self._blobs.move_to_end(cached.digest)
+                return cached.digest, None
+            # Evicted by a concurrent request while revalidating
+            fetched = await fetch_image(client, image_url)
+
+        content, digest = fetched.content, fetched.digest
+        metrics.BYTES_IN.labels(source="download").inc(fetched.size)
+        if fetched.cacheable and (fetched.etag or fetched.last_modified):
+            if digest not in self._blobs:
+                try:
+                    await asyncio.to_thread(self._write_blob, digest, content)
+                except BaseException:
+                    content.close()
+                    raise
+                self._blobs[digest] = fetched.size
+                self._total_bytes += fetched.size
+            self._blobs.move_to_end(digest)
+            self._urls[image_url] = CachedUrl(digest, fetched.etag, fetched.last_modified)
+            self._evict()
+        return digest, content
+
+    async def digest(self, client: httpx.AsyncClient, image_url: str) -> str:
+        """The sha256 of an image URL's bytes, downloading them unless the cached copy is current."""
+        digest, content = await self.fetch(client, image_url)
+        if content is not None:
+            content.close()
+        return digest
+
+    async def load(self, digest: str) -> BinaryIO:
+        """Open a cached blob; the caller closes it."""
+        return await asyncio.to_thread(open, self._blob_path(digest), "rb")
+
+    async def open(self, client: httpx.AsyncClient, image_url: str, label: str = "image") -> BinaryIO:
+        """Return the bytes of an image URL, reusing the cached copy while it is current; the caller closes them."""
+        with span(f"{label}_download"):
+            digest, content = await self.fetch(client, image_url)
+            return content if content is not None else await self.load(digest)
+
+    def uploaded_name(self, comfy: ComfyClient, key: str) -> str | None:
+        name = self._uploads.get((comfy, key))
+        if name is not None:
+            self._uploads.move_to_end((comfy, key))
+        return name
+
+    def record_upload(self, comfy: ComfyClient, key: str, name: str):
+        self._uploads[(comfy, key)] = name
+        self._uploads.move_to_end((comfy, key))
+        while len(self._uploads) > self.max_uploads:
+            (evicted_comfy, evicted_key), evicted_name = self._uploads.popitem(last=False)
+            # Uploads still in use are left to the janitor's sweep
+            if (evicted_comfy, evicted_key) not in self._holders:
+                self._delete_upload(evicted_comfy, evicted_key, evicted_name)
+
+    def _delete_upload(self, comfy: ComfyClient, key: str, name: str):
+        # Another backend sharing the input folder may still use or be writing the same file
+        if any(other == key for _, other in self._uploads) or any(other == key for _, other in self._holders):
+            return
+        comfy.delete_input(name)
+
+    def forget_uploads(self, comfy: ComfyClient):
+        """Upload every image to ``comfy`` again from now on, e.g. after it restarted."""
+        for entry in [entry for entry in self._uploads if entry[0] is comfy]:
+            del self._uploads[entry]
+
+    def uploaded_names(self) -> set[str]:
+        """File names in ComfyUI's input folders that later requests may reference."""
+        return set(self._uploads.values())
+
+    @contextmanager
+    def holding(self):
+        """Track the uploads one request depends on; pass the yielded list to :meth:`stage`.
+
+        If the request is abandoned (it times out or is cancelled), uploads
+        that no other request holds are forgotten and deleted from ComfyUI's
+        input folder rather than left behind.
+        """
+        holds: list[tuple[ComfyClient, str]] = []
+        abandoned = False
+        try:
+            yield holds
+        except (TimeoutError, asyncio.CancelledError):
+            abandoned = True
+            raise
+        finally:
+            for entry in holds:
+                self._holders[entry] -= 1
+                if self._holders[entry] > 0:
+                    continue
+                del self._holders[entry]
+                name = self._uploads.pop(entry, None) if abandoned else None
+                if name is not None:
+                    self._delete_upload(*entry, name)
+
+    async def stage(
+        self,
+        client: httpx.AsyncClient,
+        comfy: ComfyClient,
+        image_url: str,
+        label: str = "image",
+        scale: dict | None = None,
+        holds: list[tuple[ComfyClient, str]] | None = None,
+        keep_original: bool = False,
+        fetched: tuple[str, BinaryIO | None] | None = None,
+    ) -> StagedImage:
+        """Make an image URL available in ComfyUI's input folder.
+
+        ``scale`` is passed on to :func:`prepare_image`. Decoding waits for
+        its estimated working memory in the shared :class:`MemoryBudget`.
+        Steps are timed as ``<label>_download``/``_prepare``/``_upload`` spans.
+        The upload is held for the request that passes ``holds`` from
+        :meth:`holding`. With ``keep_original`` the downloaded bytes are
+        returned as well, rewound, and the caller closes them; they must be
+        within ``max_pixels`` at full size, not just once scaled. ``fetched``
+        is what an earlier :meth:`fetch` of ``image_url`` returned, staged
+        (and closed) instead of downloading the image again.
+        """
+        if fetched is None:
+            with span(f"{label}_download"):
+                fetched = await self.fetch(client, image_url)
+        digest, content = fetched
+        try:
+            if keep_original:
+                if content is None:
+                    content = await self.load(digest)
+                await asyncio.to_thread(check_full_size, content, self.max_pixels)
+            # The same image scaled differently is a different upload
+            key = digest if scale is None else "{}-{megapixels}mp-{resolution_steps}-{method}".format(digest, **scale)
+            if holds is not None:
+                # Held before uploading, so an abandoned request cannot delete it mid-upload
+                self._holders[(comfy, key)] += 1
+                holds.append((comfy, key))
+            name = self.uploaded_name(comfy, key)
+            if name is not None:
+                return self._staged(name, digest, content, keep_original)
+
+            with span(f"{label}_prepare"):
+                if content is None:
+                    content = await self.load(digest)
+                # Header-only probe: rejects oversized images before anything is decoded
+                needed = await asyncio.to_thread(decode_memory, content, self.max_pixels, **(scale or {}))
+                async with self.memory.reserve(needed):
+                    # Decoding, scaling and PNG encoding are CPU bound; keep them off the event loop
+                    image = await asyncio.to_thread(prepare_image, content, self.max_pixels, **(scale or {}))
+            with span(f"{label}_upload"):
+                # Content-addressed names never clash with different data, so overwriting is safe
+                name = await comfy.upload_image(
+                    f"{key}.{image.extension}", image.buffer, image.content_type, overwrite=True
+                )
+            metrics.BYTES_OUT.labels(destination="comfy_upload").inc(image.buffer.seek(0, os.SEEK_END))
+            self.record_upload(comfy, key, name)
+            return self._staged(name, digest, content, keep_original)
+        except BaseException:
+            if content is not None:
+                content.close()
+            raise
+
+    @staticmethod
+    def _staged(name: str, digest: str, content: BinaryIO | None, keep_original: bool) -> StagedImage:
+        if not keep_original:
+            if content is not None:
+                content.close()
+            return StagedImage(name, digest)
+        content.seek(0)
+        return StagedImage(name, digest, content)
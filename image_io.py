@@ -0,0 +1,295 @@
+import asyncio
+import hashlib
+import ipaddress
+import math
+import tempfile
+from io import BytesIO
+from typing import BinaryIO, NamedTuple
+from urllib.parse import urlparse
+
+import httpx
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+# Formats ComfyUI's LoadImage reads as-is; anything else is re-encoded to PNG
+PASSTHROUGH_FORMATS = {
+    "PNG": ("image/png", "png"),
+    "JPEG": ("image/jpeg", "jpg"),
+    "WEBP": ("image/webp", "webp"),
+}
+
+# PIL filters matching ComfyUI's upscale_method choices
+RESAMPLING = {
+    "nearest-exact": PILImage.Resampling.NEAREST,
+    "bilinear": PILImage.Resampling.BILINEAR,
+    "area": PILImage.Resampling.BOX,
+    "bicubic": PILImage.Resampling.BICUBIC,
+    "lanczos": PILImage.Resampling.LANCZOS,
+}
+EXIF_ORIENTATION = 0x0112
+
+# Downloads larger than this are spooled to a temporary file instead of RAM
+SPOOL_BYTES = 4 * 1024 * 1024
+# Working memory per decoded pixel: the decoded image plus a converted or resized copy, 4 bands each
+DECODE_BYTES_PER_PIXEL = 8
+
+
+class FetchedImage(NamedTuple):
+    """Downloaded image bytes plus the validators needed to revalidate them."""
+    content: BinaryIO | None  # None when the server answered 304 Not Modified
+    etag: str | None
+    last_modified: str | None
+    cacheable: bool
+    digest: str | None = None  # sha256 of content
+    size: int = 0
+
+
+class IngestedImage(NamedTuple):
+    """Upload-ready image bytes plus the type ComfyUI should store them as."""
+    buffer: BinaryIO
+    content_type: str
+    extension: str
+
+
+def validate_image_url(url: str):
+    """Validate image URL to prevent SSRF attacks."""
+    parsed = urlparse(url)
+
+    # Only allow http/https
+    if parsed.scheme not in ['http', 'https']:
+        raise ValueError(f"Invalid URL scheme: {parsed.scheme}. Only http/https allowed.")
+
+    # Check hostname
+    hostname = parsed.hostname
+    if not hostname:
+        raise ValueError("Invalid URL: missing hostname")
+
+    # Prevent localhost/private IP access
+    hostname_lower = hostname.lower()
+    if hostname_lower in ['localhost', 'localhost.localdomain']:
+        raise ValueError("Access to localhost not allowed")
+
+    # Check for private IP addresses
+    try:
+        ip = ipaddress.ip_address(hostname)
+        if ip.is_private or ip.is_loopback or ip.is_reserved:
+            raise ValueError(f"Access to private IP addresses not allowed: {hostname}")
+    except ValueError:
+        # Not an IP address, check for common private patterns
+        if any(hostname_lower.startswith(prefix) for prefix in ['192.168.', '10.', '172.16.', '172.17.', '172.18.', '172.19.', '172.20.', '172.21.', '172.22.', '172.23.', '172.24.', '172.25.', '172.26.', '172.27.', '172.28.', '172.29.', '172.30.', '172.31.']):
+            raise ValueError(f"Access to private networks not allowed: {hostname}")
+
+
+async def fetch_image(
+    client: httpx.AsyncClient,
+    image_url: str,
+    max_size_mb: int = 50,
+    etag: str | None = None,
+    last_modified: str | None = None,
+) -> FetchedImage:
+    """Download image bytes from URL with size limits and retries.
+
+    The body is hashed while it streams in and kept in memory only up to
+    ``SPOOL_BYTES``; larger images go to a temporary file, which the caller
+    must close. When validators from an earlier download are given the
+    request is made conditional, and a 304 answer is returned with
+    ``content=None``.
+    """
+    validate_image_url(image_url)
+
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    # Add retry logic for transient failures
+    max_retries = 3
+    max_bytes = max_size_mb * 1024 * 1024
+    for attempt in range(max_retries):
+        try:
+            async with client.stream("GET", image_url, headers=headers) as response:
+                if response.status_code == 304 and headers:
+                    return FetchedImage(None, etag, last_modified, True)
+                response.raise_for_status()
+
+                # Check content length before downloading
+                content_length = response.headers.get('content-length')
+                if content_length and int(content_length) > max_bytes:
+                    raise ValueError(f"Image too large. Max size: {max_size_mb}MB")
+
+                # Download with size limit
+                content = BytesIO()
+                digest = hashlib.sha256()
+                total_size = 0
+                try:
+                    async for chunk in response.aiter_bytes(65536):
+                        total_size += len(chunk)
+                        if total_size > max_bytes:
+                            raise ValueError(f"Image exceeds {max_size_mb}MB limit")
+                        digest.update(chunk)
+                        if isinstance(content, BytesIO) and total_size > SPOOL_BYTES:
+                            # A real file rather than SpooledTemporaryFile, so httpx
+                            # uploads in-memory images without spilling them to disk
+                            spool = tempfile.TemporaryFile()
+                            spool.write(content.getbuffer())
+                            content = spool
+                        content.write(chunk)
+                except BaseException:
+                    content.close()
+                    raise
+            content.seek(0)
+            return FetchedImage(
+                content,
+                response.headers.get("etag"),
+                response.headers.get("last-modified"),
+                "no-store" not in response.headers.get("cache-control", ""),
+                digest.hexdigest(),
+                total_size,
+            )
+        except httpx.HTTPError as e:
+            if attempt < max_retries - 1:
+                await asyncio.sleep(0.5 * (attempt + 1))  # Exponential backoff
+                continue
+            raise ValueError(f"Failed to download image after {max_retries} attempts: {str(e)}")
+
+
+def total_pixels_size(width: int, height: int, megapixels: float, resolution_steps: int = 1) -> tuple[int, int]:
+    """Output size of ComfyUI's ImageScaleToTotalPixels for an input of this size."""
+    scale = math.sqrt(megapixels * 1024 * 1024 / (width * height))
+    return (
+        round(width * scale / resolution_steps) * resolution_steps,
+        round(height * scale / resolution_steps) * resolution_steps,
+    )
+
+
+def _to_rgb(pil: PILImage.Image) -> PILImage.Image:
+    """Apply EXIF orientation and flatten to RGB/L, compositing transparency on white."""
+    pil = ImageOps.exif_transpose(pil)
+    if pil.mode == 'RGBA':
+        # Create white background for transparency
+        background = PILImage.new('RGB', pil.size, (255, 255, 255))
+        background.paste(pil, mask=pil.getchannel('A'))
+        return background
+    if pil.mode not in ['RGB', 'L']:
+        return pil.convert('RGB')
+    return pil
+
+
+def _plan(pil: PILImage.Image, max_pixels: int, megapixels: float | None, resolution_steps: int, method: str):
+    """Choose the output size for an opened (not yet decoded) image.
+
+    Returns the size to scale to, or None to keep the image as it is. For
+    JPEGs a reduced-size decode is configured as a side effect. Raises
+    ValueError if the image would decode to more than ``max_pixels``.
+    """
+    target = None
+    if megapixels and method in RESAMPLING and getattr(pil, "n_frames", 1) == 1:
+        # Orientations 5-8 swap width and height once applied
+        rotated = pil.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8)
+        width, height = pil.size[::-1] if rotated else pil.size
+        size = total_pixels_size(width, height, megapixels, resolution_steps)
+        if size[0] * size[1] < width * height:
+            target = size
+            if pil.format == "JPEG":
+                # DCT scaling decodes at 1/2, 1/4 or 1/8 size, never below the request
+                pil.draft(None, size[::-1] if rotated else size)
+
+    if pil.size[0] * pil.size[1] > max_pixels:
+        raise ValueError(f"Image too large: {pil.size[0]}x{pil.size[1]} exceeds {max_pixels // 1_000_000} megapixels")
+    return target
+
+
+def _passthrough(pil: PILImage.Image, target) -> tuple | None:
+    passthrough = PASSTHROUGH_FORMATS.get(pil.format)
+    if target is None and passthrough and pil.mode in ('RGB', 'L') and getattr(pil, "n_frames", 1) == 1:
+        return passthrough
+    return None
+
+
+def decode_memory(
+    content: BinaryIO,
+    max_pixels: int,
+    megapixels: float | None = None,
+    resolution_steps: int = 1,
+    method: str = "lanczos",
+) -> int:
+    """Estimate the working memory :func:`prepare_image` needs, from the image header alone.
+
+    Raises ValueError for unreadable or oversized images, before any pixels
+    are decoded.
+    """
+    try:
+        with PILImage.open(content) as pil:
+            target = _plan(pil, max_pixels, megapixels, resolution_steps, method)
+            if _passthrough(pil, target):
+                return 0
+            return pil.size[0] * pil.size[1] * DECODE_BYTES_PER_PIXEL
+    except ValueError:
+        raise
+    except Exception as img_err:
+        raise ValueError(f"Invalid image format: {str(img_err)}")
+    finally:
+        content.seek(0)
+
+
+def check_full_size(content: BinaryIO, max_pixels: int):
+    """Raise ValueError if the image, decoded at full size, would exceed ``max_pixels``.
+
+    Header only. :func:`decode_memory` cannot tell for JPEGs, which it plans
+    to decode at reduced size.
+    """
+    try:
+        with PILImage.open(content) as pil:
+            width, height = pil.size
+    except Exception as img_err:
+        raise ValueError(f"Invalid image format: {str(img_err)}")
+    finally:
+        content.seek(0)
+    if width * height > max_pixels:
+        raise ValueError(f"Image too large: {width}x{height} exceeds {max_pixels // 1_000_000} megapixels")
+
+
+def prepare_image(
+    content: BinaryIO,
+    max_pixels: int,
+    megapixels: float | None = None,
+    resolution_steps: int = 1,
+    method: str = "lanczos",
+) -> IngestedImage:
+    """Validate downloaded bytes and make them loadable by ComfyUI.
+
+    Images that would decode to more than ``max_pixels`` are rejected from
+    their header. With ``megapixels``, images larger than that are scaled
+    down here the way ImageScaleToTotalPixels would, so the node has
+    nothing left to do; JPEGs are decoded at reduced size where possible.
+    Other RGB/L stills in a format LoadImage reads are passed through
+    untouched without decoding pixels. Everything else is decoded once,
+    flattened to RGB (transparency composited on white) and re-encoded as PNG.
+    """
+    try:
+        pil = PILImage.open(content)
+        target = _plan(pil, max_pixels, megapixels, resolution_steps, method)
+
+        passthrough = _passthrough(pil, target)
+        if passthrough:
+            # Checks structure (and PNG CRCs) without a pixel decode. On a fresh
+            # open: reading EXIF while planning may have loaded a PNG already
+            content.seek(0)
+            PILImage.open(content).verify()
+            content.seek(0)
+            return IngestedImage(content, *passthrough)
+
+        pil = _to_rgb(pil)
+        if target is not None and pil.size != target:
+            pil = pil.resize(target, RESAMPLING[method])
+
+        buf = BytesIO()
+        # The upload stays on this machine, so favour encode speed over size
+        pil.save(buf, format="PNG", compress_level=1)
+        buf.seek(0)
+        return IngestedImage(buf, "image/png", "png")
+    except ValueError:
+        raise
+    except Exception as img_err:
+        raise ValueError(f"Invalid image format: {str(img_err)}")
@@ -0,0 +1,84 @@
+import asyncio
+import os
+import re
+import time
+from typing import Callable, Collection
+
+import metrics
+
+
+class DirectoryJanitor:
+    """Periodic sweep that keeps one of ComfyUI's folders from growing without bound.
+
+    Requests delete their own files once they are done with them; the sweep
+    catches the rest (crashes, abandoned prompts, uploads still in use when
+    they fell out of the upload cache). Only top-level files whose names
+    match ``pattern`` are considered: those older than ``max_age`` seconds
+    are deleted, and while the folder is over ``max_bytes`` the oldest go
+    first. Names returned by ``in_use`` are never deleted.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        pattern: str,
+        max_age: float,
+        max_bytes: int,
+        in_use: Callable[[], Collection[str]] = frozenset,
+        label: str = "files",
+    ):
+        self.directory = directory
+        self.pattern = re.compile(pattern)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.in_use = in_use
+        self.label = label
+
+    def _entries(self) -> list:
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not self.pattern.match(entry.name) or not entry.is_file(follow_symlinks=False):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # deleted by its request meanwhile
+                    entries.append((entry.name, stat.st_size, stat.st_mtime))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def sweep(self, keep: Collection[str] = ()) -> int:
+        """Delete expired files and the oldest ones over the size limit; returns how many."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        cutoff = time.time() - self.max_age
+        deleted = 0
+        for name, size, mtime in entries:
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            if name in keep:
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            deleted += 1
+        return deleted
+
+    async def run(self, interval: float):
+        """Sweep every ``interval`` seconds until cancelled."""
+        while True:
+            try:
+                # Read on the event loop, which is what mutates the in-use set
+                keep = set(self.in_use())
+                deleted = await asyncio.to_thread(self.sweep, keep)
+                if deleted:
+                    metrics.JANITOR_DELETED.labels(folder=self.label).inc(deleted)
+                    print(f"Janitor deleted {deleted} old {self.label} files")
+            except Exception as e:
+                print(f"Janitor sweep of {self.directory} failed: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,29 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class MemoryBudget:
+    """Process-wide limit on the bytes that concurrent image decodes may reserve.
+
+    Callers reserve their estimated working memory before decoding and wait
+    while the budget is used up by others. A reservation larger than the
+    whole budget is reduced to it, so an oversized job still runs, alone.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.available = limit
+        self._changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int):
+        nbytes = min(nbytes, self.limit)
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.available >= nbytes)
+            self.available -= nbytes
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.available += nbytes
+                self._changed.notify_all()
@@ -0,0 +1,73 @@
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+from timing import PhaseTimer
+
+REGISTRY = CollectorRegistry()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 240)
+
+REQUESTS = Counter(
+    "light_transfer_requests_total", "Requests received.", ["endpoint"], registry=REGISTRY
+)
+FAILURES = Counter(
+    "light_transfer_failures_total", "Failed requests by kind of failure.", ["endpoint", "kind"], registry=REGISTRY
+)
+IN_FLIGHT = Gauge(
+    "light_transfer_in_flight_requests", "Requests currently being handled.", ["endpoint"], registry=REGISTRY
+)
+QUEUE_DEPTH = Gauge(
+    "light_transfer_comfy_queue_depth", "Prompts queued or running in ComfyUI.", registry=REGISTRY
+)
+LANE_WAITING = Gauge(
+    "light_transfer_lane_waiting", "Prompts waiting for a ComfyUI queue slot, by backend and priority lane.",
+    ["backend", "lane"], registry=REGISTRY,
+)
+COMFY_UP = Gauge(
+    "light_transfer_comfy_up", "Whether a ComfyUI instance is running and warmed up.", ["backend"], registry=REGISTRY
+)
+COMFY_RESTARTS = Counter(
+    "light_transfer_comfy_restarts_total", "ComfyUI restarts by what triggered them.", ["backend", "reason"],
+    registry=REGISTRY,
+)
+STAGE_SECONDS = Histogram(
+    "light_transfer_stage_seconds", "Duration of each request stage.", ["stage"],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+NODE_SECONDS = Histogram(
+    "light_transfer_node_seconds", "ComfyUI execution time per workflow node.", ["node", "class_type"],
+    buckets=LATENCY_BUCKETS, registry=REGISTRY,
+)
+CANCELLED_PROMPTS = Counter(
+    "light_transfer_cancelled_prompts_total", "Prompts withdrawn from ComfyUI after their request gave up on them.",
+    ["reason"], registry=REGISTRY,
+)
+JANITOR_DELETED = Counter(
+    "light_transfer_janitor_deleted_files_total", "Leftover files deleted by the periodic sweep.", ["folder"],
+    registry=REGISTRY,
+)
+RESULT_CACHE = Counter(
+    "light_transfer_result_cache_total", "Result cache lookups by outcome.", ["outcome"], registry=REGISTRY
+)
+COALESCED = Counter(
+    "light_transfer_coalesced_total", "Requests that waited for an identical request in flight instead of running their own.",
+    registry=REGISTRY,
+)
+BYTES_IN = Counter(
+    "light_transfer_bytes_in_total", "Bytes read, by source.", ["source"], registry=REGISTRY
+)
+BYTES_OUT = Counter(
+    "light_transfer_bytes_out_total", "Bytes written, by destination.", ["destination"], registry=REGISTRY
+)
+
+
+def observe_stages(timer: PhaseTimer):
+    """Feed a finished request's stage durations into the stage histogram."""
+    for stage, seconds in timer.phases.items():
+        # Per-node timings already have their own histogram
+        if not stage.startswith("node_"):
+            STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+
+def render() -> tuple[bytes, str]:
+    """Return the Prometheus text exposition and its content type."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
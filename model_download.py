@@ -0,0 +1,160 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+BUFFER_SIZE = 1024 * 1024
+MAX_FILE_WORKERS = 8
+MAX_SEGMENT_WORKERS = 16
+MAX_RETRIES = 5
+
+
+def download_models(models, segment_workers: int = MAX_SEGMENT_WORKERS, segment_size: int = SEGMENT_SIZE):
+    """Download every missing entry of a model list concurrently.
+
+    Each entry needs ``url`` and ``path``. Files that already exist are
+    skipped; everything else goes through :func:`download_file`, with all
+    files sharing one pool of segment workers.
+    """
+    missing = [model for model in models if not os.path.exists(model["path"])]
+    if not missing:
+        return
+
+    with ThreadPoolExecutor(segment_workers) as segment_pool, \
+            ThreadPoolExecutor(min(len(missing), MAX_FILE_WORKERS)) as file_pool:
+        futures = [
+            file_pool.submit(download_file, model["url"], model["path"], segment_pool, segment_size)
+            for model in missing
+        ]
+        for future in futures:
+            future.result()
+
+
+def download_file(url: str, path: str, pool: ThreadPoolExecutor, segment_size: int = SEGMENT_SIZE):
+    """Download ``url`` to ``path`` via a ``.part`` file that is renamed only once complete.
+
+    Servers that support range requests are fetched as parallel segments
+    submitted to ``pool``; finished segments are recorded next to the
+    ``.part`` file so an interrupted download resumes where it stopped.
+    Other servers are streamed in a single request. The models volume is
+    shared by every worker, so an exclusive lock on ``<path>.lock`` keeps
+    workers that start together from writing the same ``.part`` file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another worker may have finished it while this one waited for the lock
+            if os.path.exists(path):
+                return
+            _download_locked(url, path, pool, segment_size)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _download_locked(url: str, path: str, pool: ThreadPoolExecutor, segment_size: int):
+    part_path = f"{path}.part"
+    state_path = f"{path}.part.json"
+
+    # Resolve redirects once so every segment goes straight to the file host
+    with requests.head(url, allow_redirects=True, timeout=30) as head:
+        head.raise_for_status()
+        final_url = head.url
+        size = int(head.headers.get("content-length", 0)) or None
+        ranged = size is not None and head.headers.get("accept-ranges", "").lower() == "bytes"
+
+    if ranged:
+        _download_segments(final_url, part_path, state_path, size, pool, segment_size)
+    else:
+        _download_stream(final_url, part_path)
+
+    actual = os.path.getsize(part_path)
+    if size is not None and actual != size:
+        raise RuntimeError(f"Size mismatch for {url}: expected {size} bytes, got {actual}")
+
+    os.replace(part_path, path)
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    print(f"Downloaded {path} ({actual} bytes)")
+
+
+def _download_stream(url: str, part_path: str):
+    with requests.get(url, stream=True, timeout=60) as r:
+        r.raise_for_status()
+        with open(part_path, "wb") as f:
+            for chunk in r.iter_content(BUFFER_SIZE):
+                f.write(chunk)
+
+
+def _load_state(state_path: str, size: int, segment_size: int) -> set:
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    if state.get("size") != size or state.get("segment_size") != segment_size:
+        return set()
+    return set(state.get("done", []))
+
+
+def _download_segments(url, part_path, state_path, size, pool, segment_size):
+    done = _load_state(state_path, size, segment_size) if os.path.exists(part_path) else set()
+    if not done:
+        # Preallocate so segments can be written at their offsets in any order
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+
+    segments = [
+        (index, start, min(start + segment_size, size) - 1)
+        for index, start in enumerate(range(0, size, segment_size))
+        if index not in done
+    ]
+    if done:
+        print(f"Resuming {part_path}: {len(done)} segments already present, {len(segments)} left")
+
+    lock = threading.Lock()
+
+    def record(index):
+        with lock:
+            done.add(index)
+            tmp = f"{state_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"url": url, "size": size, "segment_size": segment_size, "done": sorted(done)}, f)
+            os.replace(tmp, state_path)
+
+    futures = [pool.submit(_fetch_segment, url, part_path, start, end, index, record) for index, start, end in segments]
+    for future in futures:
+        future.result()
+
+
+def _fetch_segment(url, part_path, start, end, index, on_done):
+    for attempt in range(MAX_RETRIES):
+        try:
+            headers = {"Range": f"bytes={start}-{end}"}
+            with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise RuntimeError(f"Server ignored range request (status {r.status_code})")
+                fd = os.open(part_path, os.O_WRONLY)
+                try:
+                    offset = start
+                    for chunk in r.iter_content(BUFFER_SIZE):
+                        os.pwrite(fd, chunk, offset)
+                        offset += len(chunk)
+                    if offset != end + 1:
+                        raise RuntimeError(f"Short segment: got bytes {start}-{offset - 1}, expected {start}-{end}")
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            on_done(index)
+            return
+        except (requests.RequestException, RuntimeError) as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+            print(f"Segment {index} of {part_path} failed ({e}), retrying")
+            time.sleep(2 ** attempt)
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_SAFETENSORS_HEADER = 100 * 1024 * 1024
+MAX_HASH_WORKERS = 4
+
+
+def check_safetensors(path: str, size: int):
+    """Prove a safetensors file is complete from its header alone.
+
+    The file starts with a little-endian u64 header length followed by a
+    JSON table of tensor byte ranges; a complete file ends exactly where
+    the last tensor does. Raises ValueError otherwise.
+    """
+    with open(path, "rb") as f:
+        prefix = f.read(8)
+        if len(prefix) != 8:
+            raise ValueError("file too short for a safetensors header")
+        (header_len,) = struct.unpack("<Q", prefix)
+        if header_len > min(size - 8, MAX_SAFETENSORS_HEADER):
+            raise ValueError(f"invalid header length {header_len}")
+        header = json.loads(f.read(header_len))
+
+    try:
+        data_end = max(
+            (tensor["data_offsets"][1] for name, tensor in header.items() if name != "__metadata__"),
+            default=0,
+        )
+    except (KeyError, IndexError, TypeError, AttributeError):
+        raise ValueError("malformed safetensors header")
+    if 8 + header_len + data_end != size:
+        raise ValueError(f"expected {8 + header_len + data_end} bytes, file has {size}")
+
+
+def sha256_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class ModelManifest:
+    """Integrity records for model files, persisted next to the models.
+
+    Each path maps to its size, sha256 and the mtime at which it was
+    verified. A file whose size and mtime still match its record is trusted
+    after an O(1) stat plus a safetensors header check; anything else is
+    hashed in full once and recorded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._forgotten = set()
+        self.entries = self._read()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        with self._lock:
+            # Other workers share the volume; keep whatever they recorded meanwhile
+            entries = {**self._read(), **self.entries}
+            for path in self._forgotten:
+                entries.pop(path, None)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(entries, f, indent=2, ensure_ascii=False)
+            os.replace(tmp, self.path)
+            self.entries = entries
+
+    def forget(self, path: str):
+        with self._lock:
+            self.entries.pop(path, None)
+            self._forgotten.add(path)
+
+    def verify(self, model: dict):
+        """Check one model file, hashing it only if it is not already recorded.
+
+        Raises ValueError if the file is truncated or its hash does not match
+        the optional ``sha256`` of the model entry.
+        """
+        path = model["path"]
+        stat = os.stat(path)
+        if path.endswith(".safetensors"):
+            check_safetensors(path, stat.st_size)
+
+        entry = self.entries.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            digest = entry["sha256"]
+        else:
+            print(f"Hashing {path} ({stat.st_size} bytes)")
+            digest = sha256_file(path)
+
+        expected = model.get("sha256")
+        if expected and digest != expected:
+            raise ValueError(f"sha256 mismatch: expected {expected}, got {digest}")
+
+        with self._lock:
+            self._forgotten.discard(path)
+            self.entries[path] = {"size": stat.st_size, "sha256": digest, "mtime_ns": stat.st_mtime_ns}
+
+
+def verify_models(models, manifest: ModelManifest) -> list:
+    """Verify every present model file, deleting the ones that fail.
+
+    Returns the paths that were removed so callers can download them again.
+    """
+    present = [model for model in models if os.path.exists(model["path"])]
+    removed = []
+
+    def check(model):
+        try:
+            manifest.verify(model)
+        except ValueError as e:
+            print(f"Removing corrupt model {model['path']}: {e}")
+            manifest.forget(model["path"])
+            os.remove(model["path"])
+            removed.append(model["path"])
+
+    if present:
+        with ThreadPoolExecutor(min(len(present), MAX_HASH_WORKERS)) as pool:
+            list(pool.map(check, present))
+        manifest.save()
+    return removed
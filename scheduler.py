@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+import metrics
+from comfy_client import ComfyClient
+from timing import span
+
+
+class OverloadedError(Exception):
+    """Raised when the backlog would not finish in time; safe to retry later."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Prompts a request was admitted for and has not yet handed to ComfyUI, and their lane."""
+
+    def __init__(self, prompts: int, lane: str):
+        self.unsubmitted = prompts
+        self.released = 0  # given up by PromptScheduler.release, not counted as waiting
+        self.lane = lane
+
+
+class PromptScheduler:
+    """Two-stage pipeline in front of a ComfyUI that runs one prompt at a time.
+
+    Input preparation (download, decode, upload) runs concurrently, bounded
+    by :attr:`prep`. Queueing a prompt then takes one of ``gpu_depth``
+    slots, held until the prompt finishes: with two slots ComfyUI always
+    has the next prompt uploaded and queued behind the running one, while
+    everyone else waits here, where waiting is cheap and can be refused.
+
+    Admission compares ComfyUI's ``/queue`` plus the prompts admitted here
+    against the caller's time budget, using a running average of prompt
+    execution time, and rejects work that would time out anyway. While
+    paused, for example during a ComfyUI restart, everything is rejected.
+
+    Requests belong to a priority lane. Queue slots go to the waiter that
+    arrived first, counting each arrival ``lane_delays[lane]`` seconds
+    late: a lane with a larger delay lets later work from the others go
+    first, until its own has waited that long. Admission only counts work
+    in lanes that rank ahead of or with the request's own.
+    """
+
+    def __init__(
+        self,
+        comfy: ComfyClient,
+        prep_concurrency: int,
+        gpu_depth: int = 2,
+        initial_prompt_seconds: float = 20.0,
+        smoothing: float = 0.2,
+        lane_delays: dict[str, float] | None = None,
+    ):
+        self.comfy = comfy
+        self.prep = asyncio.Semaphore(prep_concurrency)
+        self.prompt_seconds = initial_prompt_seconds
+        self.smoothing = smoothing
+        self.lane_delays = lane_delays or {"default": 0.0}
+        self._free_slots = gpu_depth
+        self._slot_waiters: list = []  # heap of [rank, arrival order, future]
+        self._arrivals = itertools.count()
+        self._unsubmitted: Counter[str] = Counter()  # by lane
+        self._running = 0
+        self._last_finished = 0.0
+        self._observed = False
+        self._paused: tuple[str, int] | None = None
+
+    def pause(self, reason: str, retry_after: int):
+        """Reject new work, and queued work about to be submitted, until :meth:`resume`."""
+        self._paused = (reason, retry_after)
+
+    def resume(self):
+        self._paused = None
+
+    @property
+    def paused(self) -> tuple[str, int] | None:
+        """Why and for about how long work is rejected, if it is."""
+        return self._paused
+
+    def _check_paused(self):
+        if self._paused is not None:
+            raise OverloadedError(*self._paused)
+
+    @property
+    def default_lane(self) -> str:
+        return min(self.lane_delays, key=self.lane_delays.get)
+
+    def _unsubmitted_ahead(self, lane: str) -> int:
+        """Prompts admitted but not yet queued in lanes that rank ahead of or with ``lane``."""
+        delay = self.lane_delays[lane]
+        return sum(count for other, count in self._unsubmitted.items() if self.lane_delays[other] <= delay)
+
+    def expected_wait(self, lane: str | None = None) -> float:
+        """Seconds of admitted work ahead of a new request in ``lane``, from local counts only."""
+        return (self._unsubmitted_ahead(lane or self.default_lane) + self._running) * self.prompt_seconds
+
+    async def backlog(self, lane: str | None = None) -> int:
+        """Prompts ahead of a new request in ``lane``: ComfyUI's queue plus those admitted but not yet queued."""
+        queue = await self.comfy.get_queue()
+        queued = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+        return queued + self._unsubmitted_ahead(lane or self.default_lane)
+
+    @asynccontextmanager
+    async def admit(
+        self,
+        prompts: int,
+        budget: float,
+        required: int | None = None,
+        cost: float = 1.0,
+        lane: str | None = None,
+    ):
+        """Admit a request for ``prompts`` prompts that must finish within ``budget`` seconds.
+
+        Raises :class:`OverloadedError` if the work already waiting would leave
+        too little of the budget for the first ``required`` prompts (default:
+        all of them), each taking ``cost`` times as long as an average prompt.
+        Yields a :class:`Ticket` to pass to :meth:`gpu_slot`.
+        """
+        self._check_paused()
+        lane = lane or self.default_lane
+        if lane not in self.lane_delays:
+            raise ValueError(f"Unknown priority lane: {lane}")
+        ticket = Ticket(prompts, lane)
+        # Counted before the queue is read, so concurrent admissions see each other
+        self._unsubmitted[lane] += prompts
+        try:
+            backlog = await self.backlog(lane) - prompts
+            estimate = (backlog + (prompts if required is None else required) * cost) * self.prompt_seconds
+            if estimate > budget:
+                raise OverloadedError(
+                    f"{backlog} prompts are ahead (about {estimate:.0f}s of work with this request, "
+                    f"limit {budget:.0f}s)",
+                    retry_after=max(1, math.ceil(estimate - budget)),
+                )
+            yield ticket
+        finally:
+            self._unsubmitted[lane] -= ticket.unsubmitted
+
+    def release(self, ticket: Ticket):
+        """Stop counting ``ticket``'s prompts as waiting, for a request that shares another's result instead."""
+        self._unsubmitted[ticket.lane] -= ticket.unsubmitted
+        ticket.released += ticket.unsubmitted
+        ticket.unsubmitted = 0
+
+    def reclaim(self, ticket: Ticket):
+        """Count prompts given up by :meth:`release` again, once the request has to run them after all."""
+        self._unsubmitted[ticket.lane] += ticket.released
+        ticket.unsubmitted += ticket.released
+        ticket.released = 0
+
+    @asynccontextmanager
+    async def gpu_slot(self, ticket: Ticket, deadline: float, cost: float = 1.0):
+        """Hold a queue slot while one prompt is submitted and executed.
+
+        ``deadline`` is on the event loop clock and ``cost`` is the prompt's
+        run time relative to an average one. Raises TimeoutError if no slot
+        frees up in time and :class:`OverloadedError` if too little time is
+        left to run the prompt once it does.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            with span("gpu_wait"):
+                await asyncio.wait_for(self._acquire_slot(ticket.lane), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timed out waiting for the GPU")
+
+        running = succeeded = False
+        try:
+            self._check_paused()
+            needed = self.prompt_seconds * cost
+            if deadline - loop.time() < needed:
+                raise OverloadedError(
+                    f"Too little time left to run the prompt (about {needed:.0f}s needed)",
+                    retry_after=math.ceil(needed),
+                )
+            ticket.unsubmitted -= 1
+            self._unsubmitted[ticket.lane] -= 1
+            self._running += 1
+            running = True
+            entered = time.perf_counter()
+            yield
+            succeeded = True
+        finally:
+            if running:
+                self._running -= 1
+            if succeeded:
+                # Prompts run one at a time, so this one started when the previous finished
+                now = time.perf_counter()
+                # Normalised, so the average stays comparable across prompts of different cost
+                self._observe((now - max(entered, self._last_finished)) / cost)
+                self._last_finished = now
+            self._release_slot()
+
+    async def _acquire_slot(self, lane: str):
+        if self._free_slots > 0 and not self._slot_waiters:
+            self._free_slots -= 1
+            return
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        heapq.heappush(self._slot_waiters, [loop.time() + self.lane_delays[lane], next(self._arrivals), waiter])
+        waiting = metrics.LANE_WAITING.labels(backend=self.comfy.host, lane=lane)
+        waiting.inc()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()  # handed a slot just as it gave up
+            raise
+        finally:
+            waiting.dec()
+
+    def _release_slot(self):
+        # Waiters that gave up stay in the heap until they come up here
+        while self._slot_waiters:
+            waiter = heapq.heappop(self._slot_waiters)[2]
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free_slots += 1
+
+    def observe(self, seconds: float, cost: float = 1.0):
+        """Count a prompt that ran outside :meth:`gpu_slot`, like a warm-up, towards the estimate."""
+        self._observe(seconds / cost)
+
+    def _observe(self, seconds: float):
+        if not self._observed:
+            # The initial figure is a guess; the first real measurement replaces it
+            self.prompt_seconds = seconds
+            self._observed = True
+        else:
+            self.prompt_seconds += self.smoothing * (seconds - self.prompt_seconds)
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+import metrics
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; callers with the same key share its outcome.
+
+    The call runs in the task of the caller that started it, on that
+    caller's resources (admission ticket, uploads, deadline). If that caller
+    is cancelled, or fails with one of the ``personal`` errors that only
+    concern it (like its own deadline passing), the callers waiting on it
+    are not failed with it: the next one runs its own call instead. Any
+    other result or error is handed to every caller. ``on_wait`` is called
+    whenever a caller starts waiting on another's call, e.g. to give up
+    resources it holds for its own.
+    """
+
+    def __init__(self, personal: tuple[type[BaseException], ...] = ()):
+        self.personal = personal
+        self._flights: dict[str, asyncio.Future] = {}
+
+    async def run(
+        self, key: str, call: Callable[[], Awaitable[T]], on_wait: Callable[[], None] | None = None
+    ) -> T:
+        while (flight := self._flights.get(key)) is not None:
+            metrics.COALESCED.inc()
+            if on_wait is not None:
+                on_wait()
+            try:
+                # Shielded, so a waiter that goes away does not take the flight with it
+                return await asyncio.shield(flight)
+            except asyncio.CancelledError:
+                if not flight.cancelled():
+                    raise  # this waiter was cancelled
+                # The caller running it gave up; take over
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            result = await call()
+        except (asyncio.CancelledError, *self.personal):
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+            # Retrieved here, so nobody waiting is not logged as an unhandled error
+            flight.exception()
+            raise
+        finally:
+            del self._flights[key]
+        flight.set_result(result)
+        return result
@@ -0,0 +1,61 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+
+class PhaseTimer:
+    """Wall-clock durations of named phases, which may overlap."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = time.perf_counter() - start
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = seconds
+
+    def server_timing(self) -> str:
+        """Format the phases as a ``Server-Timing`` header value (milliseconds)."""
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items())
+
+    def report(self, event: str) -> dict:
+        return {
+            "event": event,
+            "total_s": round(time.perf_counter() - self.started, 3),
+            "phases_s": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+        }
+
+
+# Timer of the request being handled in the current task, if any
+_active_timer: ContextVar[PhaseTimer | None] = ContextVar("active_timer", default=None)
+
+
+@contextmanager
+def activate(timer: PhaseTimer):
+    """Make ``timer`` collect the :func:`span` timings of this task and its children."""
+    token = _active_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _active_timer.reset(token)
+
+
+def active_timer() -> PhaseTimer | None:
+    return _active_timer.get()
+
+
+def span(name: str):
+    """Time a block into the active request timer; a no-op outside a request."""
+    timer = _active_timer.get()
+    return timer.phase(name) if timer is not None else nullcontext()
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import re
+import sys
+from collections import deque
+
+from workflow import WORKFLOW_JSON
+
+REQUIRED_CLASS_TYPES = {"LoadImage", "KSampler", "SaveImage"}
+
+_SLOT_PATTERN = re.compile(r'"@@slot:(\w+)@@"')
+
+
+def _slot_marker(role: str) -> str:
+    return f"@@slot:{role}@@"
+
+
+def _links(node: dict):
+    for name, value in node.get("inputs", {}).items():
+        if isinstance(value, list) and len(value) == 2 and isinstance(value[0], str):
+            yield name, value[0]
+
+
+def _upstream(graph: dict, node_id: str) -> set:
+    seen, stack = set(), [node_id]
+    while stack:
+        for _, source in _links(graph[stack.pop()]):
+            if source not in seen:
+                seen.add(source)
+                stack.append(source)
+    return seen
+
+
+def _single(graph: dict, class_type: str) -> str:
+    matches = [node_id for node_id, node in graph.items() if node.get("class_type") == class_type]
+    if len(matches) != 1:
+        raise ValueError(f"Invalid workflow: expected exactly one {class_type} node, found {len(matches)}")
+    return matches[0]
+
+
+def topological_order(graph: dict) -> list:
+    """Order node ids so every node follows its inputs; raises ValueError on cycles."""
+    dependents = {node_id: [] for node_id in graph}
+    pending = {node_id: 0 for node_id in graph}
+    for node_id, node in graph.items():
+        for name, source in _links(node):
+            if source not in graph:
+                raise ValueError(f"Invalid workflow: node {node_id} input '{name}' references missing node {source}")
+            dependents[source].append(node_id)
+            pending[node_id] += 1
+
+    ready = deque(node_id for node_id, count in pending.items() if count == 0)
+    order = []
+    while ready:
+        node_id = ready.popleft()
+        order.append(node_id)
+        for dependent in dependents[node_id]:
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                ready.append(dependent)
+    if len(order) != len(graph):
+        raise ValueError("Invalid workflow: graph contains a cycle")
+    return order
+
+
+def find_slots(graph: dict) -> dict:
+    """Locate each tunable input by its role in a light transfer graph.
+
+    Returns ``{role: [(node_id, input_name), ...]}``. The main image is the
+    LoadImage feeding the sampler's latent; the reference is the other one.
+    """
+    sampler = _single(graph, "KSampler")
+    latent_source = graph[sampler]["inputs"]["latent_image"][0]
+    load_images = [node_id for node_id, node in graph.items() if node.get("class_type") == "LoadImage"]
+    latent_inputs = _upstream(graph, latent_source) | {latent_source}
+    main = [node_id for node_id in load_images if node_id in latent_inputs]
+    reference = [node_id for node_id in load_images if node_id not in main]
+    if len(main) != 1 or len(reference) != 1:
+        raise ValueError("Invalid workflow: cannot tell the main LoadImage from the reference LoadImage")
+
+    scalers = [
+        node_id for node_id, node in graph.items()
+        if node.get("class_type") == "ImageScaleToTotalPixels"
+    ]
+    positive = graph[sampler]["inputs"]["positive"][0]
+
+    slots = {
+        "main_image": [(main[0], "image")],
+        "reference_image": [(reference[0], "image")],
+        "seed": [(sampler, "seed")],
+        "steps": [(sampler, "steps")],
+        "megapixels": [(node_id, "megapixels") for node_id in scalers],
+        "resolution_steps": [
+            (node_id, "resolution_steps") for node_id in scalers if "resolution_steps" in graph[node_id]["inputs"]
+        ],
+    }
+    if "prompt" in graph[positive].get("inputs", {}):
+        slots["prompt"] = [(positive, "prompt")]
+    return {role: fields for role, fields in slots.items() if fields}
+
+
+def find_input_scalers(graph: dict, slots: dict) -> dict:
+    """Map each image role to the ImageScaleToTotalPixels node that is the only consumer of its LoadImage.
+
+    Images whose pixels reach the graph only through such a node can be
+    scaled before upload without changing what the rest of the graph sees.
+    """
+    consumers = {}
+    for node_id, node in graph.items():
+        for name, source in _links(node):
+            consumers.setdefault(source, []).append((node_id, node["inputs"][name][1]))
+
+    scalers = {}
+    for role in ("main_image", "reference_image"):
+        load_image = slots[role][0][0]
+        uses = consumers.get(load_image, [])
+        if len(uses) == 1 and uses[0][1] == 0 and graph[uses[0][0]]["class_type"] == "ImageScaleToTotalPixels":
+            scalers[role] = uses[0][0]
+    return scalers
+
+
+class WorkflowTemplate:
+    """A validated graph with its role slots and a pre-serialized render template.
+
+    The graph is checked once (links, required node types, no cycles) and
+    its tunable inputs are located by role rather than node id. Rendering
+    substitutes only those values into pre-serialized JSON, so the request
+    path never copies or walks the graph.
+    """
+
+    def __init__(self, graph: dict):
+        missing = REQUIRED_CLASS_TYPES - {node.get("class_type") for node in graph.values()}
+        if missing:
+            raise ValueError(f"Invalid workflow: missing node types {sorted(missing)}")
+
+        self.order = topological_order(graph)
+        self.class_types = {node_id: node["class_type"] for node_id, node in graph.items()}
+        self.output_node = _single(graph, "SaveImage")
+        self.output_prefix = graph[self.output_node]["inputs"].get("filename_prefix", "ComfyUI")
+        self.slots = find_slots(graph)
+        self.defaults = {
+            role: graph[fields[0][0]]["inputs"][fields[0][1]] for role, fields in self.slots.items()
+        }
+        self.input_scalers = find_input_scalers(graph, self.slots)
+        self._scaler_inputs = {node_id: dict(graph[node_id]["inputs"]) for node_id in self.input_scalers.values()}
+
+        # Serialize once with a marker in every slot, then split around the markers
+        marked = {node_id: dict(node, inputs=dict(node.get("inputs", {}))) for node_id, node in graph.items()}
+        for role, fields in self.slots.items():
+            for node_id, name in fields:
+                marked[node_id]["inputs"][name] = _slot_marker(role)
+        text = json.dumps(marked, ensure_ascii=False, separators=(",", ":"))
+        self._chunks = _SLOT_PATTERN.split(text)  # alternates literal text and role names
+        self.digest = hashlib.sha256(text.encode()).hexdigest()
+
+    def render(self, **values) -> str:
+        """Return the prompt graph as JSON text with the given slot values filled in.
+
+        Roles that are not given keep their value from the source graph.
+        """
+        unknown = set(values) - set(self.slots)
+        if unknown:
+            raise ValueError(f"Unknown workflow parameters: {sorted(unknown)}")
+        parts = list(self._chunks)
+        for i in range(1, len(parts), 2):
+            role = parts[i]
+            parts[i] = json.dumps(values.get(role, self.defaults[role]), ensure_ascii=False)
+        return "".join(parts)
+
+    def input_scale(self, role: str, **values) -> dict | None:
+        """How the graph scales the image of ``role``, for scaling it before upload.
+
+        Returns ``megapixels``, ``resolution_steps`` and ``method`` as they
+        would be rendered with ``values``, or None if the image is used
+        unscaled or the scale is not a literal.
+        """
+        node_id = self.input_scalers.get(role)
+        if node_id is None:
+            return None
+
+        def value(name):
+            for slot_role, fields in self.slots.items():
+                if (node_id, name) in fields and slot_role in values:
+                    return values[slot_role]
+            return self._scaler_inputs[node_id].get(name)
+
+        scale = {
+            "megapixels": value("megapixels"),
+            "resolution_steps": value("resolution_steps") or 1,
+            "method": value("upscale_method"),
+        }
+        if any(isinstance(v, list) for v in scale.values()):
+            return None
+        return scale
+
+
+def compile_workflow(graph: dict) -> WorkflowTemplate:
+    return WorkflowTemplate(graph)
+
+
+LIGHT_TRANSFER_GRAPH = WORKFLOW_JSON["input"]["workflow"]
+LIGHT_TRANSFER = compile_workflow(LIGHT_TRANSFER_GRAPH)
+
+
+def _main(argv):
+    """``--check PATH`` fails if PATH differs from workflow.py; ``--write PATH`` regenerates it."""
+    if len(argv) != 2 or argv[0] not in ("--check", "--write"):
+        print("usage: python workflow_compiler.py --check|--write workflow.json")
+        return 2
+    mode, path = argv
+    if mode == "--write":
+        with open(path, "w") as f:
+            json.dump(LIGHT_TRANSFER_GRAPH, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        return 0
+    with open(path) as f:
+        if json.load(f) != LIGHT_TRANSFER_GRAPH:
+            print(f"{path} is out of sync with workflow.py; run: python workflow_compiler.py --write {path}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))